@@ -24,12 +24,9 @@ class Site:
 
         # main data storage for the committed values -> Dict[str: list[DataLog]]
         # Format: data_id -> list[DataLog]
+        # Uncommitted writes are buffered by the transaction itself (Transaction.write_buffer)
         self.data_store = {}
 
-        # temporary storage for any write instruction -> Dict[str: list[DataLog]]
-        # Format: data_id -> history of data_values
-        self.data_history = {}
-
         self.initialize_site_data()
 
     def initialize_site_data(self):
@@ -52,8 +49,6 @@ class Site:
                     committed=True
                 ))
 
-                self.data_history[data_id] = []
-
     def get_value_using_snapshot_isolation(self, data_id: str, timestamp: int) -> Any:
         """
         Author(s):
@@ -84,46 +79,19 @@ class Site:
         Author(s):
             - Akash Kumar Shrivastva
         """
-        if data_id not in self.data_store:
-            return False
-
-        self.data_history[data_id].append(DataLog(
-            value=value,
-            timestamp=timestamp,
-            transaction_id=t_id,
-            committed=False
-        ))
-        return True
+        # The value itself stays in the transaction's write buffer until commit,
+        # the site only has to accept the write
+        return data_id in self.data_store
 
-    def persist(self, t_id: str, data_id: str, timestamp: int):
+    def persist(self, t_id: str, data_id: str, value: int, timestamp: int):
         """
         Author(s):
             - Rishav Roy
             - Akash Kumar Shrivastva
         """
-        data_history = self.data_history[data_id]
-        valid_logs = [log for log in reversed(data_history) if log.transaction_id == t_id]
-        if not valid_logs:
-            return
-
-        last_log = valid_logs[0]
-        commit_value = last_log.value
-
         self.data_store[data_id].append(DataLog(
-            value=commit_value,
+            value=value,
             timestamp=timestamp,
             transaction_id=t_id,
             committed=True
         ))
-
-    def dump(self) -> str:
-        """
-        Author(s):
-            - Rishav Roy
-            - Akash Kumar Shrivastva
-        """
-        status = f"site {self.site_id} - "
-        ordered_data = sorted(self.data_store.keys(), key=extract_num)
-        data_status = [f"{data_id}: {self.data_store[data_id][-1].value}" for data_id in ordered_data]
-        status += ", ".join(data_status)
-        return status
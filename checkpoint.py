@@ -0,0 +1,290 @@
+import io
+import os
+import pickle
+import struct
+import zlib
+from typing import Dict, Optional, Tuple
+
+# Checkpoint file layout:
+#   header: MAGIC + format version (unsigned short, big endian)
+#   records: kind (unsigned char) + payload length (unsigned int) + zlib compressed pickle payload
+# The first record is a full snapshot, every following one a delta holding only what changed since
+# the previous record. Restoring replays the records in order; a record cut short or damaged by a crash
+# ends the checkpoint, and a run appending to the file again first cuts it off after the last good record.
+MAGIC = b"RCDBCKPT"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct(">8sH")
+RECORD_HEADER = struct.Struct(">BI")
+
+FULL_RECORD = 0
+DELTA_RECORD = 1
+
+# State that is either stored record by record, belongs to the running process
+# or is configuration - the command line of the resumed run decides it
+SITE_MANAGER_EXCLUDED = {"sites", "verbose", "profiler", "dirty_chains", "catch_up_batch_size"}
+TRANSACTION_MANAGER_EXCLUDED = {
+    "site_manager", "transaction_map", "conflict_graph", "begin_order", "validation_index",
+    "verbose", "profiler", "dirty_transactions", "graph_changes", "eager_validation", "blocking_policy"
+}
+
+# Optional components carrying state across a resume -> option configuring them
+# Their settings are recorded, and a checkpoint only resumes with the same settings
+SITE_MANAGER_COMPONENTS = {"fault_injector": "--faults", "latency": "--latency"}
+TRANSACTION_MANAGER_COMPONENTS = {
+    "replica_selector": "--replica-policy", "retry_engine": "--retry", "contention": "--contention"
+}
+
+
+class Checkpointer:
+    """
+    Writes the simulator state to a checkpoint file every N commands.
+
+    A delta only holds what changed since the previous checkpoint: the versions, transactions
+    and commit times tracked by SiteManager.dirty_chains, TransactionManager.dirty_transactions
+    and ReaderWriterIndex.dirty_data_ids, the conflict graph edges and index readers / writers
+    added or removed meanwhile, and the items appended to the lists that grow with the trace
+    (see growing_lists). The remaining bookkeeping (site status, pending queues, waiting set, ...)
+    stays small and is written as a whole.
+    """
+
+    def __init__(self, path: str, every: int, site_manager, transaction_manager, append_at: Optional[int] = None):
+        if every < 1:
+            raise ValueError("Checkpoints must be at least 1 command apart")
+        self.path = path
+        self.every = every
+        self.site_manager = site_manager
+        self.transaction_manager = transaction_manager
+
+        # Appending continues an existing checkpoint file (after a resume) with deltas,
+        # right after its last complete record - a record torn by the crash is cut off
+        self.has_full_record = append_at is not None and os.path.exists(path)
+        if self.has_full_record:
+            with open(path, 'r+b') as file:
+                file.truncate(append_at)
+        else:
+            with open(path, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+        # The managers record the changes the next delta is built from from now on
+        self.track_changes()
+
+    def track_changes(self):
+        if self.transaction_manager.graph_changes is None:
+            self.transaction_manager.graph_changes = []
+        self.transaction_manager.graph_changes.clear()
+        self.transaction_manager.validation_index.track_changes()
+        # length of every growing list at the last checkpoint
+        self.written_lengths = {name: len(items) for name, items in growing_lists(self.site_manager).items()}
+
+    def after_command(self, timestamp: int, clock: int):
+        if timestamp % self.every == 0:
+            self.write(timestamp, clock)
+
+    def write(self, timestamp: int, clock: int):
+        site_manager = self.site_manager
+        transaction_manager = self.transaction_manager
+        full = not self.has_full_record
+        lists = growing_lists(site_manager)
+        payload = build_record(site_manager, transaction_manager, timestamp, clock, full)
+        payload["appended"] = {
+            name: items[0 if full else self.written_lengths.get(name, 0):] for name, items in lists.items()
+        }
+        data = zlib.compress(dump_record(payload, lists))
+
+        with open(self.path, 'ab') as file:
+            file.write(RECORD_HEADER.pack(FULL_RECORD if full else DELTA_RECORD, len(data)))
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.has_full_record = True
+        site_manager.dirty_chains.clear()
+        transaction_manager.dirty_transactions.clear()
+        self.track_changes()
+
+
+def growing_lists(site_manager) -> Dict[str, list]:
+    """
+    Lists that only ever grow with the trace, by the name they are recorded under.
+    A record pickles them by name and only holds the items appended since the previous record.
+    """
+    lists = {f"site_log {site_id}": status.site_log for site_id, status in site_manager.site_status.items()}
+    if site_manager.latency is not None:
+        lists["latency finished"] = site_manager.latency.finished
+        for kind, latencies in site_manager.latency.operation_latencies.items():
+            lists[f"latency {kind}"] = latencies
+    return lists
+
+
+def dump_record(record: dict, lists: Dict[str, list]) -> bytes:
+    # Only the site manager's state holds growing lists: it is pickled apart, so that the bulk
+    # of the record (versions, transactions, graph changes) is not looked up object by object
+    names = {id(items): name for name, items in lists.items()}
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = lambda obj: names.get(id(obj))
+    pickler.dump(record["site_manager"])
+    return pickle.dumps(dict(record, site_manager=buffer.getvalue()), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_record(data: bytes, lists: Dict[str, list]) -> dict:
+    # Growing lists resolve to the ones restored so far, which then receive the record's appended items
+    record = pickle.loads(data)
+    unpickler = pickle.Unpickler(io.BytesIO(record["site_manager"]))
+    unpickler.persistent_load = lambda name: lists.setdefault(name, [])
+    record["site_manager"] = unpickler.load()
+    for name, items in record.get("appended", {}).items():
+        lists.setdefault(name, []).extend(items)
+    return record
+
+
+def build_record(site_manager, transaction_manager, timestamp: int, clock: int, full: bool) -> dict:
+    index = transaction_manager.validation_index
+    if full:
+        chain_starts = {
+            (site_id, data_id): 0 for site_id, site in site_manager.sites.items() for data_id in site.data_store
+        }
+        t_ids = list(transaction_manager.transaction_map.keys())
+    else:
+        chain_starts = site_manager.dirty_chains
+        # Keep begin order so that the restored transaction_map iterates like the original one
+        t_ids = sorted(transaction_manager.dirty_transactions, key=transaction_manager.begin_order.__getitem__)
+
+    record = {
+        "timestamp": timestamp,
+        # logical time of the driver, ahead of the trace timestamp once retries replayed operations
+        "clock": clock,
+        # (site_id, data_id) -> (index of the first changed version, versions from that index on)
+        "chains": {
+            (site_id, data_id): (start, site_manager.sites[site_id].data_store[data_id][start:])
+            for (site_id, data_id), start in chain_starts.items()
+        },
+        "transactions": {
+            t_id: transaction_manager.transaction_map[t_id] for t_id in t_ids
+        },
+        "begin_order": {
+            t_id: transaction_manager.begin_order[t_id] for t_id in t_ids
+        },
+        "settings": component_settings(site_manager, transaction_manager),
+        "site_manager": {
+            key: value for key, value in vars(site_manager).items() if key not in SITE_MANAGER_EXCLUDED
+        },
+        "transaction_manager": {
+            key: value for key, value in vars(transaction_manager).items() if key not in TRANSACTION_MANAGER_EXCLUDED
+        }
+    }
+    if full:
+        record["conflict_graph"] = {t_id: transaction_manager.conflict_graph[t_id] for t_id in t_ids}
+        record["validation_index"] = index.export_entries(site_manager.data_ids)
+    else:
+        # edges added or removed since the previous record, in order
+        record["graph_changes"] = transaction_manager.graph_changes
+        record["validation_changes"] = index.export_changes()
+    return record
+
+
+def settings_of(value):
+    # Comparable form of a component's configuration: objects become their class name and attributes
+    if isinstance(value, dict):
+        return tuple(sorted((key, settings_of(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(settings_of(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return type(value).__name__, settings_of(vars(value))
+    return value
+
+
+def component_settings(site_manager, transaction_manager) -> dict:
+    # option -> settings of the component it configures (None when it is off)
+    settings = {}
+    for manager, components in ((site_manager, SITE_MANAGER_COMPONENTS), (transaction_manager, TRANSACTION_MANAGER_COMPONENTS)):
+        for name, option in components.items():
+            component = getattr(manager, name)
+            settings[option] = None if component is None else (
+                type(component).__name__,
+                settings_of({setting: getattr(component, setting) for setting in component.SETTINGS})
+            )
+    return settings
+
+
+def restore_checkpoint(path: str, site_manager, transaction_manager) -> Tuple[int, int, int]:
+    """
+    Loads a checkpoint file into freshly created managers.
+    :return: timestamp of the last trace command covered by the checkpoint, the driver clock at that point
+             and the offset right after the last complete record
+    """
+    with open(path, 'rb') as file:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not a checkpoint file")
+
+        magic, version = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a checkpoint file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported checkpoint format version {version} (expected {FORMAT_VERSION})")
+
+        timestamp = clock = 0
+        end_offset = file.tell()
+        settings = component_settings(site_manager, transaction_manager)
+        lists = {}
+        while True:
+            record_header = file.read(RECORD_HEADER.size)
+            if len(record_header) < RECORD_HEADER.size:
+                break
+            kind, length = RECORD_HEADER.unpack(record_header)
+            data = file.read(length)
+            if len(data) < length or kind not in (FULL_RECORD, DELTA_RECORD):
+                # last record was cut short - resume from the previous one
+                break
+            if kind == FULL_RECORD:
+                lists.clear()
+            try:
+                record = load_record(zlib.decompress(data), lists)
+            except (zlib.error, pickle.UnpicklingError, EOFError):
+                # last record was damaged while being written - same as cut short
+                break
+
+            for option, value in record.get("settings", {}).items():
+                if settings.get(option) != value:
+                    raise ValueError(f"{path} was written with different {option} settings: resume with the same options")
+            if kind == FULL_RECORD:
+                transaction_manager.transaction_map.clear()
+                transaction_manager.conflict_graph.clear()
+                transaction_manager.begin_order.clear()
+            apply_record(record, site_manager, transaction_manager)
+            timestamp = record["timestamp"]
+            clock = record.get("clock", timestamp)
+            end_offset = file.tell()
+
+    if timestamp == 0:
+        raise ValueError(f"{path} does not hold any complete checkpoint")
+    return timestamp, clock, end_offset
+
+
+def apply_record(record: dict, site_manager, transaction_manager):
+    for (site_id, data_id), (start, versions) in record["chains"].items():
+        data_store = site_manager.sites[site_id].data_store
+        data_store[data_id] = data_store[data_id][:start] + versions
+    transaction_manager.transaction_map.update(record["transactions"])
+    transaction_manager.begin_order.update(record["begin_order"])
+
+    conflict_graph = transaction_manager.conflict_graph
+    if "conflict_graph" in record:
+        conflict_graph.update(record["conflict_graph"])
+        transaction_manager.validation_index.import_entries(record["validation_index"])
+    else:
+        for change, edge_type, t_id, source_ids in record["graph_changes"]:
+            if change == "add":
+                for source_id in source_ids:
+                    conflict_graph[source_id].setdefault(edge_type, set()).add(t_id)
+            elif change == "remove":
+                for source_id in source_ids:
+                    conflict_graph[source_id][edge_type].discard(t_id)
+            else:
+                conflict_graph[t_id] = dict()
+        transaction_manager.validation_index.import_changes(record["validation_changes"])
+
+    vars(site_manager).update(record["site_manager"])
+    vars(transaction_manager).update(record["transaction_manager"])
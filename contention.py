@@ -0,0 +1,230 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data_models import AbortType, EdgeType
+
+# Aborts caused by conflicting transactions - failures and blocking policies are not contention
+CONTENTION_ABORTS = {AbortType.FIRST_COMMITTER_WRITE, AbortType.CONSECUTIVE_RW_CYCLE}
+
+
+class CountMinSketch:
+    """
+    Approximate counter over an unbounded set of keys in fixed memory.
+    Estimates never undercount; they overcount by at most about e / width of the total count
+    with probability 1 - e^-depth.
+    """
+
+    def __init__(self, width: int = 1024, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows: List[List[int]] = [[0] * width for _ in range(depth)]
+
+    def columns(self, key: str) -> List[int]:
+        # One digest split into depth independent 32 bit hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width for row in range(self.depth)]
+
+    def add(self, key: str, count: int = 1):
+        for row, column in enumerate(self.columns(key)):
+            self.rows[row][column] += count
+
+    def estimate(self, key: str) -> int:
+        return min(self.rows[row][column] for row, column in enumerate(self.columns(key)))
+
+
+class TopK:
+    """
+    Space-Saving heavy hitters: keeps at most capacity keys. A new key evicts the one with the
+    smallest count and inherits that count, so counts are upper bounds and every key seen more
+    than total / capacity times is guaranteed to be kept.
+    Keys are grouped by count, so the key to evict is found without scanning every key.
+    """
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+
+        # monitored keys -> Dict[str, int]
+        self.counts: Dict[str, int] = {}
+
+        # count inherited from the evicted key, the most a count can be off by -> Dict[str, int]
+        self.errors: Dict[str, int] = {}
+
+        # monitored keys grouped by count, oldest first -> Dict[int, Dict[str, None]]
+        self.buckets: Dict[int, Dict[str, None]] = {}
+        self.min_count = 0
+
+    def add(self, key: str, count: int = 1):
+        if key in self.counts:
+            self.set_count(key, self.counts[key] + count)
+        elif len(self.counts) < self.capacity:
+            self.errors[key] = 0
+            self.set_count(key, count)
+        else:
+            evicted = next(iter(self.buckets[self.min_count]))
+            inherited = self.counts[evicted]
+            self.drop(evicted)
+            self.errors[key] = inherited
+            self.set_count(key, inherited + count)
+
+    def set_count(self, key: str, count: int):
+        previous = self.counts.get(key)
+        if previous is not None:
+            self.remove_from_bucket(key, previous)
+        self.counts[key] = count
+        self.buckets.setdefault(count, {})[key] = None
+        if count < self.min_count or self.min_count not in self.buckets:
+            self.min_count = min(self.buckets)
+
+    def drop(self, key: str):
+        self.remove_from_bucket(key, self.counts.pop(key))
+        self.errors.pop(key)
+
+    def remove_from_bucket(self, key: str, count: int):
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+
+    def guaranteed(self, key: str) -> int:
+        return self.counts[key] - self.errors[key]
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+class ContentionAnalyzer:
+    """
+    Low overhead record of where contention comes from, fed by the Transaction Manager.
+
+    Per data item reads, writes, aborts and conflict edges are counted in count-min sketches,
+    and a top-k tracker follows the items involved in the most conflicts (edges and aborts).
+    Edges are also counted per EdgeType, with a top-k of the transaction pairs forming RW edges.
+    Every data item a commit validation conflicted on is paired with every other one of the
+    same validation, which gives the key x key conflict heatmap - again kept in a sketch.
+    Memory stays bounded however many data items and transactions the trace holds.
+
+    A validation can add hundreds of edges, so the edges of a validation are summed per data
+    item first and only reach the sketches once the validation is over.
+    """
+
+    # configuration a checkpoint only resumes with
+    SETTINGS = ("top_k",)
+
+    def __init__(self, top_k: int = 10, width: int = 1024, depth: int = 4):
+        self.top_k = top_k
+
+        # per data item counters
+        self.reads = CountMinSketch(width, depth)
+        self.writes = CountMinSketch(width, depth)
+        self.aborts = CountMinSketch(width, depth)
+        self.edges = CountMinSketch(width, depth)
+
+        # data items involved in the most conflicts, tracked with some slack over top_k
+        self.hot_keys = TopK(4 * top_k)
+
+        # edges formed of every type, and the transaction pairs forming the most RW edges
+        self.edge_counts: Dict[EdgeType, int] = {edge_type: 0 for edge_type in EdgeType}
+        self.rw_pairs = TopK(4 * top_k)
+
+        # pairs of data items conflicting in the same validation -> sketch keyed by "x|y"
+        self.pairs = CountMinSketch(width, depth)
+
+        # transaction being validated by end() and the edges it formed so far per data item
+        self.validating: Optional[str] = None
+        self.validation_edges: Dict[str, int] = {}
+
+    def record_read(self, data_id: str):
+        self.reads.add(data_id)
+
+    def record_write(self, data_id: str):
+        self.writes.add(data_id)
+
+    def start_validation(self, t_id: str):
+        self.finish_validation()
+        self.validating = t_id
+
+    def finish_validation(self):
+        for data_id, count in self.validation_edges.items():
+            if count:
+                self.edges.add(data_id, count)
+                self.hot_keys.add(data_id, count)
+
+        keys = sorted(self.validation_edges)
+        for i, first in enumerate(keys):
+            for second in keys[i:]:
+                self.pairs.add(f"{first}|{second}")
+        self.validating = None
+        self.validation_edges = {}
+
+    def record_edge(self, edge_type: EdgeType, from_id: str, to_id: str, data_ids: Iterable[str]):
+        self.edge_counts[edge_type] += 1
+        if edge_type == EdgeType.RW:
+            self.rw_pairs.add(f"{from_id} -> {to_id}")
+        for data_id in data_ids:
+            self.validation_edges[data_id] = self.validation_edges.get(data_id, 0) + 1
+
+    def record_abort(self, t_id: str, abort_type: AbortType, data_id: Optional[str]):
+        # A first committer abort names its data item, a RW cycle is blamed on the items of the edges it formed -
+        # which only belong to t_id while t_id itself is being validated
+        if abort_type not in CONTENTION_ABORTS:
+            return
+
+        if data_id is not None:
+            keys = [data_id]
+        elif self.validating == t_id:
+            keys = list(self.validation_edges)
+        else:
+            return
+        for key in keys:
+            self.aborts.add(key)
+            self.hot_keys.add(key)
+            if self.validating == t_id:
+                self.validation_edges.setdefault(key, 0)
+
+    def hot_key_rows(self) -> List[Tuple[str, int, int, int, int]]:
+        # (data item, reads, writes, aborts, edges) of the hottest items, most aborts first
+        rows = [
+            (key, self.reads.estimate(key), self.writes.estimate(key), self.aborts.estimate(key), self.edges.estimate(key))
+            for key, _ in self.hot_keys.top(len(self.hot_keys.counts))
+        ]
+        rows.sort(key=lambda row: (-row[3], -row[4], -(row[1] + row[2]), row[0]))
+        return rows[:self.top_k]
+
+    def heatmap(self, data_ids: List[str]) -> List[List[int]]:
+        return [
+            [self.pairs.estimate("|".join(sorted((first, second)))) for second in data_ids]
+            for first in data_ids
+        ]
+
+    def report(self):
+        self.finish_validation()
+        rows = self.hot_key_rows()
+
+        print("\nHOT KEYS")
+        print("rank | data item | reads | writes | aborts | conflict edges")
+        for rank, (key, reads, writes, aborts, edges) in enumerate(rows, 1):
+            print(f"{rank} | {key} | {reads} | {writes} | {aborts} | {edges}")
+
+        print("\nCONFLICT EDGES")
+        for edge_type in EdgeType:
+            print(f"{edge_type.value}: {self.edge_counts[edge_type]}")
+
+        # Only pairs seen at least twice for sure - transaction ids are unique unless retried
+        recurring = sorted(
+            ((pair, self.rw_pairs.guaranteed(pair)) for pair in self.rw_pairs.counts if self.rw_pairs.guaranteed(pair) > 1),
+            key=lambda item: (-item[1], item[0])
+        )
+        if recurring:
+            print("recurring RW pairs: " + ", ".join(f"{pair} ({count})" for pair, count in recurring[:self.top_k]))
+
+        print("\nCONFLICT HEATMAP")
+        data_ids = [row[0] for row in rows]
+        if not data_ids:
+            print("no conflicts")
+            return
+        cells_by_row = self.heatmap(data_ids)
+        width = max(len(str(cell)) for cells in cells_by_row for cell in cells)
+        width = max(width, max(len(data_id) for data_id in data_ids)) + 1
+        print(" " * width + "".join(data_id.rjust(width) for data_id in data_ids))
+        for data_id, cells in zip(data_ids, cells_by_row):
+            print(data_id.ljust(width) + "".join(str(cell).rjust(width) for cell in cells))
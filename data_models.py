@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 
 # Data Models
@@ -20,6 +20,9 @@ class AbortType(Enum):
     IMPOSSIBLE_READ = "IMPOSSIBLE_READ"
     FIRST_COMMITTER_WRITE = "FIRST_COMMITTER_WRITE"
     CONSECUTIVE_RW_CYCLE = "CONSECUTIVE_RW_CYCLE"
+    WAIT_TIMEOUT = "WAIT_TIMEOUT"
+    QUEUE_OVERFLOW = "QUEUE_OVERFLOW"
+    WAIT_DIE = "WAIT_DIE"
 
 
 class EdgeType(Enum):
@@ -47,6 +50,10 @@ class Transaction:
     # List of sites accessed by this transaction - Tuple content - (site_id, operation, timestamp)
     sites_accessed: List[Tuple[int, str, int]]
     commit_time: int
+    # Uncommitted writes of this transaction - data_id -> last value written
+    write_buffer: Dict[str, int] = field(default_factory=dict)
+    # Sites holding an uncommitted write of this transaction - data_id -> set of site_ids
+    written_sites: Dict[str, Set[int]] = field(default_factory=dict)
 
 
 @dataclass
@@ -54,3 +61,13 @@ class SiteStatus:
     status: bool  # True if site is up, False if down
     last_failure_time: int
     site_log: List[Tuple[bool, int]]
+
+
+@dataclass
+class BlockingPolicy:
+    max_wait: Optional[int] = None  # logical ticks a transaction may stay in the waiting set
+    max_queue_depth: Optional[int] = None  # pending operations a site may hold
+    wait_die: bool = False  # a transaction younger than one already queued at the site aborts instead of waiting
+
+    def is_enabled(self) -> bool:
+        return self.max_wait is not None or self.max_queue_depth is not None or self.wait_die
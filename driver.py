@@ -7,16 +7,92 @@ Author(s):
 import argparse
 import os
 import sys
+from typing import Iterable, Tuple
 
+from checkpoint import Checkpointer, restore_checkpoint
+from contention import ContentionAnalyzer
+from data_models import BlockingPolicy, TransactionStatus
+from fault_injection import FaultInjector, load_fault_injector
+from latency_sim import LatencySimulator, load_latency_simulator
+from profiler import Profiler
+from replica_selection import REPLICA_SELECTORS, ReplicaSelector, make_replica_selector
+from retry import TRANSACTION_OPERATIONS, RetryEngine
 from site_manager import SiteManager
+from trace_reader import find_command_offset, iter_commands
 from transaction_manager import TransactionManager
 
 
 class Driver:
-    def __init__(self, verbose: bool):
+    def __init__(
+            self,
+            verbose: bool,
+            profiler: Profiler = None,
+            eager_validation: bool = False,
+            catch_up_batch_size: int = 0,
+            replica_selector: ReplicaSelector = None,
+            blocking_policy: BlockingPolicy = None,
+            retry_engine: RetryEngine = None,
+            fault_injector: FaultInjector = None,
+            contention: ContentionAnalyzer = None,
+            latency: LatencySimulator = None
+    ):
         self.verbose = verbose
-        self.sm = SiteManager(verbose)
-        self.tm = TransactionManager(self.sm, verbose)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.sm = SiteManager(verbose, self.profiler, catch_up_batch_size)
+        self.tm = TransactionManager(
+            self.sm,
+            verbose,
+            self.profiler,
+            eager_validation,
+            replica_selector,
+            blocking_policy,
+            retry_engine,
+            contention
+        )
+        self.sm.fault_injector = fault_injector
+        self.sm.latency = latency
+        self.checkpointer: Checkpointer = None
+
+        # Logical time of the last executed command. Every trace command takes one tick,
+        # so it matches the trace timestamp unless retries replayed operations in between.
+        self.clock = 0
+
+    def run(self, commands: Iterable[str], first_timestamp: int = 1):
+        for timestamp, command in enumerate(commands, first_timestamp):
+            if self.sm.fault_injector is not None:
+                self.inject_faults()
+            self.clock += 1
+            self.process_line(command, self.clock)
+            if self.tm.retry_engine is not None:
+                self.run_due_retries()
+            if self.checkpointer is not None:
+                self.checkpointer.after_command(timestamp, self.clock)
+
+    def resume(self, checkpoint_path: str) -> Tuple[int, int]:
+        # Returns the timestamp to continue the trace from and the end of the checkpoint's last complete record
+        timestamp, self.clock, end_offset = restore_checkpoint(checkpoint_path, self.sm, self.tm)
+        return timestamp + 1, end_offset
+
+    def run_due_retries(self):
+        engine = self.tm.retry_engine
+        for t_id in engine.due_retries(self.clock):
+            self.tm.prepare_retry(t_id, self.clock)
+            for instruction, params in engine.start_retry(t_id):
+                # Aborted again - the rest of the log waits for the next attempt
+                if instruction != 'begin' and self.tm.transaction_map[t_id].status != TransactionStatus.ACTIVE:
+                    break
+                engine.count_replayed()
+                self.clock += 1
+                self.execute(instruction, params, self.clock)
+
+    def inject_faults(self):
+        # Failures and recoveries due before the next trace command, one tick each
+        while True:
+            command = self.sm.fault_injector.next_command(self.clock + 1, self.sm)
+            if command is None:
+                return
+            self.clock += 1
+            self.execute(*command, self.clock)
 
     def process_line(self, line: str, timestamp: int):
         parts = line.strip().split('(')
@@ -27,6 +103,36 @@ class Driver:
         params = parts[1].rstrip(')').split(',')
         params = [param.strip() for param in params]
 
+        if self.sm.fault_injector is not None:
+            self.sm.fault_injector.on_trace_command(instruction, params)
+
+        # Operations of a transaction waiting for its retry are only logged
+        engine = self.tm.retry_engine
+        if engine is not None and instruction in TRANSACTION_OPERATIONS and not engine.record(instruction, params):
+            self.after_command(timestamp)
+            return
+
+        self.execute(instruction, params, timestamp)
+
+    def execute(self, instruction: str, params: list, timestamp: int):
+        if self.sm.latency is not None:
+            self.sm.latency.advance(timestamp)
+        with self.profiler.opcode(instruction):
+            self.dispatch(instruction, params, timestamp)
+        self.after_command(timestamp)
+
+    def after_command(self, timestamp: int):
+        if self.sm.catch_up_queue:
+            with self.profiler.phase("catch_up"):
+                self.sm.advance_catch_up(timestamp)
+
+        if self.tm.wait_since:
+            self.tm.enforce_wait_timeouts(timestamp)
+
+        if self.sm.fault_injector is not None:
+            self.sm.fault_injector.observe(self.sm, self.tm)
+
+    def dispatch(self, instruction: str, params: list, timestamp: int):
         if instruction == 'begin':
             self.tm.begin(params[0], timestamp)
         elif instruction == 'R':
@@ -37,6 +143,7 @@ class Driver:
             self.tm.end(params[0], timestamp)
         elif instruction == 'fail':
             self.sm.fail(int(params[0]), timestamp)
+            self.tm.mark_site_failure_victims(int(params[0]), timestamp)
         elif instruction == 'recover':
             self.sm.recover(int(params[0]), timestamp)
             self.tm.exec_pending(int(params[0]), timestamp)
@@ -44,17 +151,6 @@ class Driver:
             self.sm.dump()
 
 
-def read_file(file):
-    commands_list = []
-    with open(file, 'r') as file:
-        for line in file:
-            stripped_line = line.strip()
-            if not stripped_line.startswith("//") and stripped_line:
-                uncommented_line = stripped_line.split("//")[0]
-                commands_list.append(uncommented_line.strip())
-    return commands_list
-
-
 if __name__ == "__main__":
     """
        Tests a single input file and prints the output to the console
@@ -63,6 +159,55 @@ if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("input_file", help="Path to the input file")
     arg_parser.add_argument("-v", "--verbose", action="store_true", help="increase output verbosity")
+    arg_parser.add_argument("--profile", metavar="PREFIX",
+                            help="trace every command and write PREFIX.folded (flame graph stacks) "
+                                 "and PREFIX.latency.txt (per-opcode latency table)")
+    arg_parser.add_argument("--eager", action="store_true",
+                            help="mark transactions for abort as soon as a conflicting commit or a site failure "
+                                 "dooms them, instead of validating only at end()")
+    arg_parser.add_argument("--snapshot", metavar="PATH",
+                            help="at the end of the run, write the latest committed value of every data item "
+                                 "at every up site to PATH as a compressed .npz (requires numpy)")
+    arg_parser.add_argument("--catch-up", action="store_true",
+                            help="let recovered sites pull the committed versions they missed from an up peer")
+    arg_parser.add_argument("--catch-up-batch", type=int, default=4, metavar="N",
+                            help="replicated data items a recovered site catches up on per tick (default: 4)")
+    arg_parser.add_argument("--replica-policy", choices=sorted(REPLICA_SELECTORS.keys()),
+                            help="order in which the replicas of a data item are tried for reads "
+                                 "(default: ascending site ids); also reports reads served per site")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed for randomized policies (default: 0)")
+    arg_parser.add_argument("--start-at", type=int, metavar="TIMESTAMP",
+                            help="with --resume, continue the trace from TIMESTAMP (the n-th command of the trace) "
+                                 "instead of right after the checkpoint, skipping the commands in between")
+    arg_parser.add_argument("--checkpoint", metavar="PATH",
+                            help="periodically write the full simulator state to PATH")
+    arg_parser.add_argument("--checkpoint-every", type=int, default=1000, metavar="N",
+                            help="commands between two checkpoints (default: 1000)")
+    arg_parser.add_argument("--resume", metavar="PATH",
+                            help="restore the state saved in checkpoint PATH and continue the trace from there")
+    arg_parser.add_argument("--max-wait", type=int, metavar="TICKS",
+                            help="abort a transaction that stays in the waiting set for more than TICKS commands")
+    arg_parser.add_argument("--max-queue-depth", type=int, metavar="N",
+                            help="abort a transaction instead of queuing it at a site already holding N pending operations")
+    arg_parser.add_argument("--wait-die", action="store_true",
+                            help="abort a transaction instead of queuing it behind an older waiting transaction")
+    arg_parser.add_argument("--retry", type=int, metavar="N",
+                            help="re-run transactions aborted for a retriable reason, at most N times each")
+    arg_parser.add_argument("--retry-backoff", type=int, default=1, metavar="TICKS",
+                            help="backoff before the first retry, doubled per attempt and scaled by contention (default: 1)")
+    arg_parser.add_argument("--faults", metavar="CONFIG",
+                            help="inject site failures and recoveries described by the JSON file CONFIG")
+    arg_parser.add_argument("--fault-seed", type=int, metavar="N",
+                            help="seed of the fault injector (default: the config's seed, else 0)")
+    arg_parser.add_argument("--contention", action="store_true",
+                            help="report the hottest data items, conflict edges and a key x key conflict heatmap")
+    arg_parser.add_argument("--contention-top", type=int, default=10, metavar="K",
+                            help="data items in the hot key report and the heatmap (default: 10)")
+    arg_parser.add_argument("--latency", metavar="CONFIG",
+                            help="simulate the latency of site operations and commits described by the JSON file CONFIG "
+                                 "and report transaction latencies and site utilization")
+    arg_parser.add_argument("--latency-seed", type=int, metavar="N",
+                            help="seed of the latency simulation (default: the config's seed, else 0)")
     args = arg_parser.parse_args()
 
     file_path = args.input_file
@@ -72,9 +217,97 @@ if __name__ == "__main__":
         print(f"File does not exist: {file_path}")
         sys.exit(1)
 
-    commands = read_file(file_path)
+    if args.faults and not os.path.exists(args.faults):
+        print(f"Fault injection config does not exist: {args.faults}")
+        sys.exit(1)
+
+    if args.latency and not os.path.exists(args.latency):
+        print(f"Latency config does not exist: {args.latency}")
+        sys.exit(1)
+
+    if args.checkpoint_every < 1:
+        print(f"--checkpoint-every must be at least 1: {args.checkpoint_every}")
+        sys.exit(1)
+
+    driver = Driver(
+        allow_verbose,
+        Profiler(enabled=args.profile is not None),
+        args.eager,
+        args.catch_up_batch if args.catch_up else 0,
+        make_replica_selector(args.replica_policy, args.seed) if args.replica_policy else None,
+        BlockingPolicy(args.max_wait, args.max_queue_depth, args.wait_die),
+        RetryEngine(args.retry, args.retry_backoff) if args.retry is not None else None,
+        load_fault_injector(args.faults, args.fault_seed) if args.faults else None,
+        ContentionAnalyzer(args.contention_top) if args.contention else None,
+        load_latency_simulator(args.latency, args.latency_seed) if args.latency else None
+    )
+
+    # Commands before start_at are only skipped, not executed: the state they build up has to come from a checkpoint
+    if args.start_at is not None and not args.resume:
+        print("--start-at needs the state of the trace at that point: use it together with --resume")
+        sys.exit(1)
+
+    start_at = 1
+    end_offset = None
+    if args.resume:
+        if not os.path.exists(args.resume):
+            print(f"Checkpoint does not exist: {args.resume}")
+            sys.exit(1)
+        try:
+            start_at, end_offset = driver.resume(args.resume)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+        if args.start_at is not None:
+            if args.start_at < start_at:
+                print(f"--start-at {args.start_at} is before the end of the checkpoint (timestamp {start_at - 1})")
+                sys.exit(1)
+            start_at = args.start_at
+
+    if args.checkpoint:
+        # Keep appending deltas when resuming from the same checkpoint file
+        append = args.resume is not None and os.path.abspath(args.resume) == os.path.abspath(args.checkpoint)
+        driver.checkpointer = Checkpointer(
+            args.checkpoint, args.checkpoint_every, driver.sm, driver.tm, end_offset if append else None
+        )
+
+    # Commands are scanned lazily from the mapped file instead of being loaded up front
+    if start_at > 1:
+        start_offset = find_command_offset(file_path, start_at)
+        commands = iter_commands(file_path, start_offset) if start_offset is not None else iter([])
+    else:
+        commands = iter_commands(file_path)
+
+    driver.run(commands, start_at)
+
+    if args.replica_policy:
+        driver.sm.read_report()
+
+    if driver.tm.blocking_policy.is_enabled():
+        driver.tm.blocking_report()
+
+    if driver.tm.retry_engine is not None:
+        driver.tm.retry_engine.report(driver.clock)
+
+    if driver.sm.fault_injector is not None:
+        driver.sm.fault_injector.report()
+
+    if driver.tm.contention is not None:
+        driver.tm.contention.report()
+
+    if driver.sm.latency is not None:
+        driver.sm.latency.report(allow_verbose)
 
-    driver = Driver(allow_verbose)
+    if args.profile:
+        driver.profiler.write_report(args.profile)
 
-    for idx, command in enumerate(commands):
-        driver.process_line(command, idx + 1)
+    if args.snapshot:
+        snapshot = driver.sm.snapshot()
+        try:
+            snapshot.save(args.snapshot)
+        except ValueError as error:
+            print(f"Snapshot not exported: {error}")
+            sys.exit(1)
+        divergent_data_ids = snapshot.divergent_data_ids()
+        if divergent_data_ids:
+            print(f"Replicas diverge on: {', '.join(divergent_data_ids)}")
@@ -0,0 +1,249 @@
+import heapq
+import json
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data_models import AbortType
+from stats import Distribution
+
+
+class FaultInjector:
+    """
+    Seeded scheduler of site failures and recoveries, injected into the driver's command stream
+    on top of the fail/recover commands of the trace. Three failure processes are supported:
+
+    - independent site failures: every site alternates between up times drawn from its MTBF
+      distribution and repairs drawn from its MTTR distribution
+    - rack failures: all up sites of a rack fail together and come back after the same repair time
+    - flapping sites: every now and then a site goes through a burst of short failures
+
+    A recovery is only injected for an outage the injector caused; when the trace itself fails or
+    recovers a site in between, the injector leaves that site alone until its next failure.
+    Between two commands the injector also samples the cluster, so the report can break
+    throughput, aborts and pending-queue depth down by the number of sites down.
+    """
+
+    # configuration a checkpoint only resumes with
+    SETTINGS = ("seed", "site_ids", "mtbf", "mttr", "racks", "flapping")
+
+    def __init__(
+            self,
+            seed: int = 0,
+            site_ids: Iterable[int] = range(1, 11),
+            mtbf: Dict[int, Distribution] = None,
+            mttr: Dict[int, Distribution] = None,
+            racks: List[dict] = None,
+            flapping: List[dict] = None
+    ):
+        """
+        :param mtbf: site_id -> time between the recovery of the site and its next failure
+        :param mttr: site_id -> time to repair the site
+        :param racks: [{"sites": [...], "mtbf": Distribution, "mttr": Distribution}]
+        :param flapping: [{"sites": [...], "every": Distribution, "flaps": int, "up": Distribution, "down": Distribution}]
+        """
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.site_ids = list(site_ids)
+        self.mtbf = mtbf or {}
+        self.mttr = mttr or {}
+        self.racks = racks or []
+        self.flapping = flapping or []
+
+        for site_id in list(self.mtbf.keys()) + [site_id for group in self.racks + self.flapping for site_id in group["sites"]]:
+            if site_id not in self.site_ids:
+                raise ValueError(f"Unknown site in fault injection config: {site_id}")
+
+        # scheduled events -> List[Tuple[tick, sequence number, kind, arguments]]
+        self.events: List[Tuple[int, int, str, tuple]] = []
+        self.sequence = 0
+
+        # outages caused by the injector -> Dict[int, int]
+        # Format: site_id -> sequence number of the failure, matched by the recovery event
+        self.outages: Dict[int, int] = {}
+
+        # injected failures by process and injected recoveries
+        self.injected: Dict[str, int] = {"site": 0, "rack": 0, "flapping": 0, "recoveries": 0}
+
+        # cluster samples grouped by the number of sites down -> Dict[int, dict]
+        self.buckets: Dict[int, dict] = {}
+        self.last_commits = 0
+        self.last_aborts: Dict[AbortType, int] = {abort_type: 0 for abort_type in AbortType}
+
+        for site_id in sorted(self.mtbf.keys()):
+            self.schedule(self.mtbf[site_id].sample(self.random), "site", (site_id,))
+        for rack_idx, rack in enumerate(self.racks):
+            self.schedule(rack["mtbf"].sample(self.random), "rack", (rack_idx,))
+        for group_idx, group in enumerate(self.flapping):
+            start = group["every"].sample(self.random)
+            for site_id in group["sites"]:
+                self.schedule(start, "flap", (group_idx, site_id, group["flaps"]))
+
+    @classmethod
+    def from_config(cls, config: dict, seed: int = None, site_ids: Iterable[int] = range(1, 11)) -> "FaultInjector":
+        """
+        Builds an injector from a JSON style config:
+        {
+            "seed": 7,
+            "mtbf": <distribution>, "mttr": <distribution>,            defaults for every site
+            "sites": {"4": {"mtbf": <distribution>, "mttr": <distribution>}},
+            "racks": [{"sites": [1, 2, 3], "mtbf": <distribution>, "mttr": <distribution>}],
+            "flapping": [{"sites": [7], "every": <distribution>, "flaps": 4, "up": <distribution>, "down": <distribution>}]
+        }
+        where a <distribution> is a mean (exponential) or {"distribution": kind, "mean": m, "shape": s}.
+        """
+        site_ids = list(site_ids)
+        overrides = {int(site_id): value for site_id, value in config.get("sites", {}).items()}
+
+        mtbf, mttr = {}, {}
+        for site_id in site_ids:
+            site_config = overrides.get(site_id, {})
+            site_mtbf = site_config.get("mtbf", config.get("mtbf"))
+            if site_mtbf is None:
+                continue
+            mtbf[site_id] = Distribution.from_config(site_mtbf)
+            mttr[site_id] = Distribution.from_config(site_config.get("mttr", config.get("mttr", 10)))
+        for site_id in overrides:
+            if site_id not in site_ids:
+                raise ValueError(f"Unknown site in fault injection config: {site_id}")
+
+        racks = [
+            {
+                "sites": rack["sites"],
+                "mtbf": Distribution.from_config(rack["mtbf"]),
+                "mttr": Distribution.from_config(rack.get("mttr", 10))
+            }
+            for rack in config.get("racks", [])
+        ]
+        flapping = [
+            {
+                "sites": group["sites"],
+                "every": Distribution.from_config(group["every"]),
+                "flaps": group.get("flaps", 3),
+                "up": Distribution.from_config(group.get("up", 3)),
+                "down": Distribution.from_config(group.get("down", 2))
+            }
+            for group in config.get("flapping", [])
+        ]
+
+        return cls(seed if seed is not None else config.get("seed", 0), site_ids, mtbf, mttr, racks, flapping)
+
+    def schedule(self, tick: int, kind: str, arguments: tuple):
+        self.sequence += 1
+        heapq.heappush(self.events, (tick, self.sequence, kind, arguments))
+
+    def next_command(self, now: int, site_manager) -> Optional[Tuple[str, list]]:
+        """
+        Pops the events due by logical time now.
+        :return: the next (instruction, params) to inject at now, None once nothing is due
+        """
+        while self.events and self.events[0][0] <= now:
+            _, sequence, kind, arguments = heapq.heappop(self.events)
+            command = self.handle(kind, arguments, sequence, now, site_manager)
+            if command is not None:
+                return command
+        return None
+
+    def handle(self, kind: str, arguments: tuple, sequence: int, now: int, site_manager) -> Optional[Tuple[str, list]]:
+        if kind == "site":
+            site_id, = arguments
+            repair = self.mttr[site_id].sample(self.random)
+            self.schedule(now + repair + self.mtbf[site_id].sample(self.random), "site", (site_id,))
+            return self.fail_site(site_id, repair, "site", now, site_manager)
+
+        if kind == "rack":
+            # Every site of the rack fails now and is repaired together
+            rack_idx, = arguments
+            rack = self.racks[rack_idx]
+            repair = rack["mttr"].sample(self.random)
+            for site_id in rack["sites"]:
+                self.schedule(now, "fail", (site_id, repair, "rack"))
+            self.schedule(now + repair + rack["mtbf"].sample(self.random), "rack", (rack_idx,))
+            return None
+
+        if kind == "flap":
+            group_idx, site_id, remaining = arguments
+            group = self.flapping[group_idx]
+            down = group["down"].sample(self.random)
+            if remaining > 1:
+                self.schedule(now + down + group["up"].sample(self.random), "flap", (group_idx, site_id, remaining - 1))
+            else:
+                self.schedule(now + down + group["every"].sample(self.random), "flap", (group_idx, site_id, group["flaps"]))
+            return self.fail_site(site_id, down, "flapping", now, site_manager)
+
+        if kind == "fail":
+            site_id, repair, source = arguments
+            return self.fail_site(site_id, repair, source, now, site_manager)
+
+        if kind == "recover":
+            site_id, outage = arguments
+            if self.outages.get(site_id) != outage or site_manager.is_site_up(site_id):
+                return None
+            del self.outages[site_id]
+            self.injected["recoveries"] += 1
+            return "recover", [str(site_id)]
+
+        return None
+
+    def fail_site(self, site_id: int, repair: int, source: str, now: int, site_manager) -> Optional[Tuple[str, list]]:
+        # Already down - either from the trace or from another failure process
+        if not site_manager.is_site_up(site_id):
+            return None
+
+        self.sequence += 1
+        self.outages[site_id] = self.sequence
+        self.schedule(now + repair, "recover", (site_id, self.sequence))
+        self.injected[source] += 1
+        return "fail", [str(site_id)]
+
+    def on_trace_command(self, instruction: str, params: list):
+        # The trace took over the site - do not recover it behind its back
+        if instruction in ("fail", "recover"):
+            self.outages.pop(int(params[0]), None)
+
+    def observe(self, site_manager, transaction_manager):
+        # One sample per logical tick
+        sites_down = sum(1 for site_id in self.site_ids if not site_manager.is_site_up(site_id))
+        pending = sum(site_manager.get_queue_depth(site_id) for site_id in self.site_ids)
+
+        bucket = self.buckets.get(sites_down)
+        if bucket is None:
+            bucket = {"ticks": 0, "commits": 0, "pending_total": 0, "pending_max": 0,
+                      "aborts": {abort_type: 0 for abort_type in AbortType}}
+            self.buckets[sites_down] = bucket
+
+        bucket["ticks"] += 1
+        bucket["commits"] += transaction_manager.commit_count - self.last_commits
+        bucket["pending_total"] += pending
+        bucket["pending_max"] = max(bucket["pending_max"], pending)
+        for abort_type, count in transaction_manager.abort_counts.items():
+            bucket["aborts"][abort_type] += count - self.last_aborts[abort_type]
+            self.last_aborts[abort_type] = count
+        self.last_commits = transaction_manager.commit_count
+
+    def report(self):
+        print("\nFAULT INJECTION REPORT")
+        print(f"injected failures: {self.injected['site']} site, {self.injected['rack']} rack, "
+              f"{self.injected['flapping']} flapping - injected recoveries: {self.injected['recoveries']}")
+
+        print("sites down | ticks | commits/tick | aborts/tick | avg pending | max pending")
+        for sites_down in sorted(self.buckets.keys()):
+            bucket = self.buckets[sites_down]
+            ticks = bucket["ticks"]
+            aborts = sum(bucket["aborts"].values())
+            print(f"{sites_down} | {ticks} | {bucket['commits'] / ticks:.3f} | {aborts / ticks:.3f} | "
+                  f"{bucket['pending_total'] / ticks:.2f} | {bucket['pending_max']}")
+
+        healthy = self.buckets.get(0, {"ticks": 0, "aborts": {abort_type: 0 for abort_type in AbortType}})
+        degraded_ticks = sum(bucket["ticks"] for sites_down, bucket in self.buckets.items() if sites_down > 0)
+        print("aborts by type - all sites up / some site down")
+        for abort_type in AbortType:
+            degraded = sum(bucket["aborts"][abort_type] for sites_down, bucket in self.buckets.items() if sites_down > 0)
+            healthy_rate = healthy["aborts"][abort_type] / healthy["ticks"] if healthy["ticks"] else 0
+            degraded_rate = degraded / degraded_ticks if degraded_ticks else 0
+            print(f"{abort_type.value}: {healthy['aborts'][abort_type]} ({healthy_rate:.3f}/tick) / "
+                  f"{degraded} ({degraded_rate:.3f}/tick)")
+
+
+def load_fault_injector(path: str, seed: int = None) -> FaultInjector:
+    with open(path) as file:
+        return FaultInjector.from_config(json.load(file), seed)
@@ -0,0 +1,267 @@
+import heapq
+import json
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from stats import Distribution, percentile
+
+# Operations served by a site, and the cross-site commit round that precedes the persists
+SERVICE_KINDS = ("read", "write", "persist")
+LATENCY_KINDS = SERVICE_KINDS + ("commit",)
+
+# Operations whose latency is reported - begin and the commit / abort decision take no time
+TIMED_OPERATIONS = ("read", "write", "commit")
+
+# Last operation of a transaction, recording its end-to-end latency
+FINISH_KINDS = ("committed", "aborted")
+
+DEFAULT_LATENCY = {"distribution": "fixed", "mean": 1.0}
+
+
+@dataclass
+class TransactionClock:
+    # simulated time at which the current incarnation of the transaction began
+    start: float = 0.0
+    # operations issued while an earlier one was still running - (kind, site jobs)
+    backlog: Deque[Tuple[str, list]] = field(default_factory=deque)
+    # operation in flight and the time it started - None when the transaction is idle
+    current: Optional[str] = None
+    current_start: float = 0.0
+    # site jobs of the operation in flight that have not completed yet
+    jobs_left: int = 0
+
+
+class LatencySimulator:
+    """
+    Discrete-event latency model running alongside the logical simulation.
+
+    Concurrency control still runs one command per logical tick; this model only decides how
+    long the operations would take. The n-th tick is issued at n * tick of simulated time, and
+    every transaction is a client running its operations one after the other: an operation
+    starts once it is issued and the previous operation of its transaction completed.
+    Every site is a FIFO server with sampled service times for Site.read, Site.write and
+    Site.persist. A commit sends a message to every site holding one of its writes (cross-site
+    commit latency), which then persists them; the commit completes with the slowest site.
+
+    Events live on a priority queue ordered by simulated time. Site failures are not modelled:
+    a job already queued at a site that fails still completes.
+    """
+
+    # configuration a checkpoint only resumes with
+    SETTINGS = ("seed", "tick", "latencies")
+
+    def __init__(
+            self,
+            latencies: Dict[int, Dict[str, Distribution]],
+            tick: float = 1.0,
+            seed: int = 0
+    ):
+        """
+        :param latencies: site_id -> read / write / persist / commit -> Distribution, in simulated time units
+        :param tick: simulated time between two logical ticks
+        """
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.latencies = latencies
+        self.tick = tick
+
+        # simulated time of the last processed event and of the last issued tick
+        self.now = 0.0
+        self.issue_time = 0.0
+
+        # scheduled events -> List[Tuple[time, sequence number, kind, arguments]]
+        self.events: List[Tuple[float, int, str, tuple]] = []
+        self.sequence = 0
+
+        # transactions with an operation issued or in flight -> Dict[str, TransactionClock]
+        self.transactions: Dict[str, TransactionClock] = {}
+
+        # end-to-end latency of every finished transaction, in finishing order
+        # Format: [(t_id, "committed" / "aborted", latency)]
+        self.finished: List[Tuple[str, str, float]] = []
+
+        # latency of every timed operation, queueing included -> Dict[str, List[float]]
+        self.operation_latencies: Dict[str, List[float]] = {kind: [] for kind in TIMED_OPERATIONS}
+
+        # per site: time at which the last queued job completes, busy time, jobs served, data items they
+        # covered (a persist job writes several) and time jobs spent queued
+        self.free_at: Dict[int, float] = {site_id: 0.0 for site_id in latencies}
+        self.busy: Dict[int, float] = {site_id: 0.0 for site_id in latencies}
+        self.jobs: Dict[int, int] = {site_id: 0 for site_id in latencies}
+        self.served: Dict[int, int] = {site_id: 0 for site_id in latencies}
+        self.queued: Dict[int, float] = {site_id: 0.0 for site_id in latencies}
+
+    @classmethod
+    def from_config(cls, config: dict, seed: int = None, site_ids: Iterable[int] = range(1, 11)) -> "LatencySimulator":
+        """
+        Builds a simulator from a JSON style config:
+        {
+            "seed": 3,
+            "tick": 1.0,
+            "read": <distribution>, "write": <distribution>,        defaults for every site
+            "persist": <distribution>, "commit": <distribution>,
+            "sites": {"10": {"commit": <distribution>, "persist": <distribution>}}
+        }
+        where a <distribution> is a mean (exponential) or {"distribution": kind, "mean": m, "shape": s}.
+        Latencies left out take a fixed 1.0.
+        """
+        site_ids = list(site_ids)
+        overrides = {int(site_id): value for site_id, value in config.get("sites", {}).items()}
+        for site_id in overrides:
+            if site_id not in site_ids:
+                raise ValueError(f"Unknown site in latency config: {site_id}")
+
+        latencies = {
+            site_id: {
+                kind: Distribution.from_config(overrides.get(site_id, {}).get(kind, config.get(kind, DEFAULT_LATENCY)))
+                for kind in LATENCY_KINDS
+            }
+            for site_id in site_ids
+        }
+        tick = config.get("tick", 1.0)
+        if tick <= 0:
+            raise ValueError("Latency config tick must be positive")
+
+        return cls(latencies, tick, seed if seed is not None else config.get("seed", 0))
+
+    def schedule(self, time: float, kind: str, arguments: tuple):
+        self.sequence += 1
+        heapq.heappush(self.events, (time, self.sequence, kind, arguments))
+
+    def sample(self, site_id: int, kind: str) -> float:
+        return self.latencies[site_id][kind].draw(self.random)
+
+    def advance(self, tick: int):
+        # Everything happening before this tick is issued is settled; later operations cannot change it
+        self.issue_time = tick * self.tick
+        self.run(self.issue_time)
+
+    def run(self, until: float = None):
+        while self.events and (until is None or self.events[0][0] < until):
+            time, _, kind, arguments = heapq.heappop(self.events)
+            self.now = time
+            if kind == "start":
+                self.start_operation(*arguments)
+            elif kind == "arrive":
+                self.serve(*arguments)
+            else:
+                self.complete_job(*arguments)
+
+    def begin(self, t_id: str):
+        self.issue(t_id, "begin", [])
+
+    def read(self, t_id: str, site_id: int):
+        self.issue(t_id, "read", [(site_id, "read", 1)])
+
+    def write(self, t_id: str, site_ids: List[int]):
+        self.issue(t_id, "write", [(site_id, "write", 1) for site_id in site_ids])
+
+    def commit(self, t_id: str, persisted: Dict[int, int]):
+        # persisted: site_id -> number of data items the site persists for the transaction
+        self.issue(t_id, "commit", [(site_id, "persist", count) for site_id, count in sorted(persisted.items())])
+
+    def finish(self, t_id: str, committed: bool):
+        self.issue(t_id, "committed" if committed else "aborted", [])
+
+    def issue(self, t_id: str, kind: str, jobs: list):
+        clock = self.transactions.get(t_id)
+        if clock is None:
+            # Only transactions that began under the simulator are timed
+            if kind != "begin":
+                return
+            clock = self.transactions[t_id] = TransactionClock(start=self.issue_time)
+
+        clock.backlog.append((kind, jobs))
+        if clock.current is None and len(clock.backlog) == 1:
+            self.schedule(self.issue_time, "start", (t_id,))
+
+    def start_operation(self, t_id: str):
+        clock = self.transactions[t_id]
+        kind, jobs = clock.backlog.popleft()
+        clock.current = kind
+        clock.current_start = self.now
+
+        if kind == "begin":
+            clock.start = self.now
+        elif kind in FINISH_KINDS:
+            self.finished.append((t_id, kind, self.now - clock.start))
+
+        if not jobs:
+            self.complete_operation(t_id)
+            return
+
+        clock.jobs_left = len(jobs)
+        for site_id, service, count in jobs:
+            delay = self.sample(site_id, "commit") if kind == "commit" else 0.0
+            self.schedule(self.now + delay, "arrive", (t_id, site_id, service, count))
+
+    def serve(self, t_id: str, site_id: int, service: str, count: int):
+        start = max(self.now, self.free_at[site_id])
+        duration = sum(self.sample(site_id, service) for _ in range(count))
+        self.free_at[site_id] = start + duration
+        self.busy[site_id] += duration
+        self.jobs[site_id] += 1
+        self.served[site_id] += count
+        self.queued[site_id] += start - self.now
+        self.schedule(start + duration, "done", (t_id,))
+
+    def complete_job(self, t_id: str):
+        clock = self.transactions[t_id]
+        clock.jobs_left -= 1
+        if clock.jobs_left == 0:
+            self.complete_operation(t_id)
+
+    def complete_operation(self, t_id: str):
+        clock = self.transactions[t_id]
+        if clock.current in self.operation_latencies:
+            self.operation_latencies[clock.current].append(self.now - clock.current_start)
+
+        finished = clock.current in FINISH_KINDS
+        clock.current = None
+        if clock.backlog:
+            # A retried transaction begins again once its aborted incarnation is over
+            self.start_operation(t_id)
+        elif finished:
+            del self.transactions[t_id]
+
+    def report(self, verbose: bool = False):
+        self.run()
+        elapsed = max(self.now, self.issue_time)
+
+        print("\nLATENCY REPORT")
+        print(f"simulated time: {elapsed:.2f} ({self.issue_time / self.tick:.0f} ticks of {self.tick})")
+        for status in FINISH_KINDS:
+            latencies = sorted(latency for _, finish_kind, latency in self.finished if finish_kind == status)
+            print(f"{status} transactions: {len(latencies)} - end-to-end p50 {percentile(latencies, 50):.2f}, "
+                  f"p99 {percentile(latencies, 99):.2f}, max {max(latencies, default=0):.2f}")
+        if self.transactions:
+            print(f"unfinished transactions: {len(self.transactions)}")
+        for kind, latencies in self.operation_latencies.items():
+            latencies = sorted(latencies)
+            print(f"{kind}: {len(latencies)} operations - p50 {percentile(latencies, 50):.2f}, "
+                  f"p99 {percentile(latencies, 99):.2f}, max {max(latencies, default=0):.2f}")
+
+        print("site utilization:")
+        for site_id in sorted(self.busy):
+            jobs = self.jobs[site_id]
+            utilization = 100 * self.busy[site_id] / elapsed if elapsed else 0
+            mean_queued = self.queued[site_id] / jobs if jobs else 0
+            print(f"site {site_id} - busy {self.busy[site_id]:.2f} ({utilization:.1f}%), "
+                  f"{jobs} jobs over {self.served[site_id]} data items, mean queueing {mean_queued:.2f}")
+
+        # Every transaction in verbose mode, the slowest ones otherwise
+        finished = self.finished
+        if not verbose:
+            finished = sorted(finished, key=lambda item: (-item[2], item[0]))[:10]
+            print("slowest transactions:")
+        else:
+            print("transaction latencies:")
+        for t_id, status, latency in finished:
+            print(f"{t_id} ({status}): {latency:.2f}")
+
+
+def load_latency_simulator(path: str, seed: int = None) -> LatencySimulator:
+    with open(path) as file:
+        return LatencySimulator.from_config(json.load(file), seed)
@@ -0,0 +1,88 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+from stats import percentile
+
+
+class Profiler:
+    """
+    Deterministic tracing profiler for trace runs.
+
+    Every command dispatched by the driver is recorded as a root frame named after its opcode,
+    and the Transaction Manager / Site Manager open nested frames for their internal phases
+    (Available Copies lookup, version scan, conflict graph DFS).
+    Self time of every frame is accumulated against its full stack, which is exactly the
+    collapsed-stack format consumed by flame graph tools.
+
+    When disabled, phase() hands out a shared no-op context so the hooks cost a single call.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+
+        # frames currently open -> List[[name, start_ns, child_ns]]
+        self.stack: List[list] = []
+
+        # self time spent in every collapsed stack -> Dict[str, int]
+        # Format: "R;available_copies" -> nanoseconds
+        self.stack_times: Dict[str, int] = defaultdict(int)
+
+        # wall time of every dispatched command -> Dict[str, List[int]]
+        # Format: opcode -> list of latencies in nanoseconds
+        self.opcode_latencies: Dict[str, List[int]] = defaultdict(list)
+
+        self._null_context = nullcontext()
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return self._null_context
+        return self._frame(name)
+
+    def opcode(self, instruction: str):
+        if not self.enabled:
+            return self._null_context
+        return self._frame(instruction, is_root=True)
+
+    @contextmanager
+    def _frame(self, name: str, is_root: bool = False):
+        frame = [name, time.perf_counter_ns(), 0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - frame[1]
+            path = ";".join(f[0] for f in self.stack)
+            self.stack.pop()
+
+            self.stack_times[path] += elapsed - frame[2]
+            if self.stack:
+                self.stack[-1][2] += elapsed
+            if is_root:
+                self.opcode_latencies[name].append(elapsed)
+
+    def write_collapsed_stacks(self, path: str):
+        # One "frame;frame;frame <microseconds>" line per stack, as expected by flamegraph.pl / speedscope
+        with open(path, 'w') as file:
+            for stack, ns in sorted(self.stack_times.items()):
+                file.write(f"{stack} {max(ns // 1000, 1)}\n")
+
+    def latency_table(self) -> str:
+        header = f"{'opcode':<10}{'count':>10}{'total(ms)':>12}{'mean(us)':>12}{'p50(us)':>12}{'p99(us)':>12}{'max(us)':>12}"
+        rows = [header]
+        for opcode in sorted(self.opcode_latencies.keys()):
+            latencies = sorted(self.opcode_latencies[opcode])
+            count = len(latencies)
+            total = sum(latencies)
+            rows.append(
+                f"{opcode:<10}{count:>10}{total / 1e6:>12.3f}{total / count / 1e3:>12.2f}"
+                f"{percentile(latencies, 50) / 1e3:>12.2f}{percentile(latencies, 99) / 1e3:>12.2f}"
+                f"{latencies[-1] / 1e3:>12.2f}"
+            )
+        return "\n".join(rows)
+
+    def write_report(self, prefix: str):
+        self.write_collapsed_stacks(f"{prefix}.folded")
+        with open(f"{prefix}.latency.txt", 'w') as file:
+            file.write(self.latency_table() + "\n")
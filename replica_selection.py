@@ -0,0 +1,94 @@
+import random
+import zlib
+from typing import Dict, List
+
+
+class ReplicaSelector:
+    """
+    Decides in which order the read ready sites of a data item are tried.
+    The base policy keeps the original behaviour: ascending site ids.
+    """
+
+    name = "ascending"
+
+    # configuration a checkpoint only resumes with
+    SETTINGS = ()
+
+    def order(self, data_id: str, site_ids: List[int], site_manager) -> List[int]:
+        return sorted(site_ids)
+
+
+class RoundRobinSelector(ReplicaSelector):
+    name = "round-robin"
+
+    def __init__(self):
+        # next replica to start from for every data item -> Dict[str, int]
+        self.cursor: Dict[str, int] = {}
+
+    def order(self, data_id: str, site_ids: List[int], site_manager) -> List[int]:
+        ordered = sorted(site_ids)
+        start = self.cursor.get(data_id, 0) % len(ordered)
+        self.cursor[data_id] = start + 1
+        return ordered[start:] + ordered[:start]
+
+
+class LeastLoadedSelector(ReplicaSelector):
+    name = "least-loaded"
+
+    def order(self, data_id: str, site_ids: List[int], site_manager) -> List[int]:
+        # Shortest pending queue first, then the site that served the fewest reads so far
+        return sorted(site_ids, key=lambda site_id: (
+            site_manager.get_queue_depth(site_id),
+            site_manager.read_counts[site_id],
+            site_id
+        ))
+
+
+class KeyHashSelector(ReplicaSelector):
+    name = "key-hash"
+
+    def order(self, data_id: str, site_ids: List[int], site_manager) -> List[int]:
+        # Every data item has a home replica, so repeated reads of it hit the same site
+        ordered = sorted(site_ids)
+        start = zlib.crc32(data_id.encode()) % len(ordered)
+        return ordered[start:] + ordered[:start]
+
+
+class PowerOfTwoChoicesSelector(ReplicaSelector):
+    name = "two-choices"
+    SETTINGS = ("seed",)
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def order(self, data_id: str, site_ids: List[int], site_manager) -> List[int]:
+        # Sample two replicas and try the less loaded one first
+        ordered = sorted(site_ids)
+        if len(ordered) < 2:
+            return ordered
+
+        choices = self.random.sample(ordered, 2)
+        choices.sort(key=lambda site_id: (
+            site_manager.get_queue_depth(site_id),
+            site_manager.read_counts[site_id],
+            site_id
+        ))
+        return choices + [site_id for site_id in ordered if site_id not in choices]
+
+
+REPLICA_SELECTORS = {
+    ReplicaSelector.name: ReplicaSelector,
+    RoundRobinSelector.name: RoundRobinSelector,
+    LeastLoadedSelector.name: LeastLoadedSelector,
+    KeyHashSelector.name: KeyHashSelector,
+    PowerOfTwoChoicesSelector.name: PowerOfTwoChoicesSelector
+}
+
+
+def make_replica_selector(name: str, seed: int = 0) -> ReplicaSelector:
+    if name not in REPLICA_SELECTORS:
+        raise ValueError(f"Unknown replica selection policy: {name}")
+    if name == PowerOfTwoChoicesSelector.name:
+        return PowerOfTwoChoicesSelector(seed)
+    return REPLICA_SELECTORS[name]()
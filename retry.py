@@ -0,0 +1,155 @@
+from typing import Dict, List, Set, Tuple
+
+from data_models import AbortType
+
+# Aborts caused by a conflict or a failure that may not happen again on a fresh snapshot.
+# An impossible read is deterministic for the same snapshot history, so it is never retried.
+RETRIABLE_ABORTS = {
+    AbortType.FIRST_COMMITTER_WRITE,
+    AbortType.CONSECUTIVE_RW_CYCLE,
+    AbortType.SITE_FAILURE,
+    AbortType.WAIT_TIMEOUT,
+    AbortType.QUEUE_OVERFLOW,
+    AbortType.WAIT_DIE
+}
+
+# Trace operations that belong to a transaction and are replayed on a retry
+TRANSACTION_OPERATIONS = {"begin", "R", "W", "end"}
+
+
+class RetryEngine:
+    """
+    Re-runs transactions aborted for a retriable reason.
+
+    The operations the trace issues for every transaction are logged as they arrive.
+    Once a transaction aborts, the rest of its trace operations are only logged, and after a
+    backoff (and once the trace has ended it) the driver replays the whole log: begin() takes a
+    fresh snapshot timestamp, every operation gets its own logical tick.
+    The backoff doubles with every attempt and grows with the number of active transactions
+    writing the data items the aborted transaction touched, so hot keys back off longer.
+    """
+
+    # configuration a checkpoint only resumes with
+    SETTINGS = ("max_retries", "base_backoff")
+
+    def __init__(self, max_retries: int = 3, base_backoff: int = 1):
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+
+        # operations of the current incarnation of every transaction -> Dict[str, List[Tuple[str, list]]]
+        # Format: t_id -> [(instruction, params)]
+        self.operation_logs: Dict[str, List[Tuple[str, list]]] = {}
+
+        # retries already spent by every transaction -> Dict[str, int]
+        self.attempts: Dict[str, int] = {}
+
+        # transactions aborted during the current tick -> Dict[str, int]
+        # Format: t_id -> backoff in logical ticks, counted from the end of that tick
+        self.backoffs: Dict[str, int] = {}
+
+        # transactions waiting to be replayed -> Dict[str, int]
+        # Format: t_id -> earliest logical tick of the replay
+        self.scheduled: Dict[str, int] = {}
+
+        # transactions whose end() was issued by the trace
+        self.ended: Set[str] = set()
+
+        # operations executed (trace and replays) and operations of transactions that committed
+        self.stats: Dict[str, int] = {
+            "executed_ops": 0,
+            "committed_ops": 0,
+            "commits": 0,
+            "commits_after_retry": 0,
+            "retries": 0,
+            "gave_up": 0
+        }
+
+    def record(self, instruction: str, params: list) -> bool:
+        """
+        Logs a trace operation of a transaction.
+        :return: False if the operation must not run now - its transaction waits for a retry
+        """
+        t_id = params[0]
+        if instruction == "begin":
+            self.operation_logs[t_id] = []
+            self.attempts[t_id] = 0
+            self.backoffs.pop(t_id, None)
+            self.scheduled.pop(t_id, None)
+            self.ended.discard(t_id)
+        elif t_id not in self.operation_logs:
+            return True
+
+        self.operation_logs[t_id].append((instruction, params))
+        if instruction == "end":
+            self.ended.add(t_id)
+
+        if self.is_waiting(t_id):
+            return False
+        self.stats["executed_ops"] += 1
+        return True
+
+    def is_waiting(self, t_id: str) -> bool:
+        return t_id in self.backoffs or t_id in self.scheduled
+
+    def on_abort(self, t_id: str, abort_type: AbortType, contention: int):
+        if t_id not in self.operation_logs:
+            return
+
+        if abort_type not in RETRIABLE_ABORTS or self.attempts[t_id] >= self.max_retries:
+            self.stats["gave_up"] += 1
+            self.forget(t_id)
+            return
+
+        self.attempts[t_id] += 1
+        backoff = self.base_backoff * 2 ** (self.attempts[t_id] - 1) * (1 + contention)
+        self.backoffs[t_id] = backoff
+        print(f"{t_id} will retry in {backoff} ticks")
+
+    def on_commit(self, t_id: str):
+        if t_id not in self.operation_logs:
+            return
+
+        self.stats["commits"] += 1
+        self.stats["committed_ops"] += len(self.operation_logs[t_id])
+        if self.attempts[t_id] > 0:
+            self.stats["commits_after_retry"] += 1
+        self.forget(t_id)
+
+    def forget(self, t_id: str):
+        self.operation_logs.pop(t_id, None)
+        self.attempts.pop(t_id, None)
+        self.backoffs.pop(t_id, None)
+        self.scheduled.pop(t_id, None)
+        self.ended.discard(t_id)
+
+    def due_retries(self, timestamp: int) -> List[str]:
+        # The backoff of transactions aborted during this tick starts now
+        for t_id, backoff in self.backoffs.items():
+            self.scheduled[t_id] = timestamp + backoff
+        self.backoffs.clear()
+
+        # Replays wait for the trace to end the transaction, so the whole log is known
+        return [
+            t_id for t_id, due_time in self.scheduled.items()
+            if due_time <= timestamp and t_id in self.ended
+        ]
+
+    def start_retry(self, t_id: str) -> List[Tuple[str, list]]:
+        del self.scheduled[t_id]
+        self.stats["retries"] += 1
+        print(f"Retrying {t_id} (attempt {self.attempts[t_id] + 1})")
+        return list(self.operation_logs[t_id])
+
+    def count_replayed(self):
+        self.stats["executed_ops"] += 1
+
+    def report(self, total_ticks: int):
+        ticks = max(total_ticks, 1)
+        print("\nRETRY REPORT")
+        print(f"retries: {self.stats['retries']}, gave up: {self.stats['gave_up']}, "
+              f"still waiting: {len(self.scheduled) + len(self.backoffs)}")
+        print(f"commits: {self.stats['commits']} ({self.stats['commits_after_retry']} after a retry)")
+        print(f"raw throughput: {self.stats['executed_ops']} operations in {total_ticks} ticks "
+              f"({self.stats['executed_ops'] / ticks:.3f}/tick)")
+        print(f"goodput: {self.stats['committed_ops']} committed operations in {total_ticks} ticks "
+              f"({self.stats['committed_ops'] / ticks:.3f}/tick)")
@@ -22,7 +22,10 @@ for input_file in "$INPUT_DIR"/input*; do
 	concise_output_file="$OUTPUT_DIR/concise/output$num"
 	verbose_output_file="$OUTPUT_DIR/verbose/output$num"
 	
+	# Driver options of the test, from a leading "// options: ..." line (paths relative to this directory)
+	options=$(sed -n 's|^// options: ||p' "$input_file" | head -n 1)
+
 	echo "Executing input$num"
-	python "$PYTHON_PROGRAM" "$input_file" > "$concise_output_file"
-	python "$PYTHON_PROGRAM" -v "$input_file" > "$verbose_output_file"
+	python "$PYTHON_PROGRAM" $options "$input_file" > "$concise_output_file"
+	python "$PYTHON_PROGRAM" -v $options "$input_file" > "$verbose_output_file"
 done
@@ -1,17 +1,25 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple
 
-from Site import Site
+from Site import Site, extract_num
 from data_models import SiteStatus, DataLog, Transaction
+from fault_injection import FaultInjector
+from latency_sim import LatencySimulator
+from profiler import Profiler
+from snapshot import ClusterSnapshot, build_snapshot
 
 
 class SiteManager:
-    def __init__(self, verbose: bool):
+    def __init__(self, verbose: bool, profiler: Profiler = None, catch_up_batch_size: int = 0):
         """
         Author(s):
             - Rishav Roy
             - Akash Kumar Shrivastva
         """
         self.verbose = verbose
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        # Number of replicated data items a recovered site catches up on per tick (0 disables catch-up)
+        self.catch_up_batch_size = catch_up_batch_size
 
         # map of sites
         self.sites: Dict[int, Site] = {
@@ -22,10 +30,11 @@ class SiteManager:
         # Format: site_id -> SiteStatus
         self.site_status = {}
 
-        # reads pending for a site -> Dict(site_id, Set(Tuple(t_id, data_id)))
+        # reads pending for a site -> Dict(site_id, Dict(Tuple(t_id, data_id), None))
+        # Dicts are used as insertion ordered sets, so pending operations run in the order they arrived
         self.pending_reads = dict()
 
-        # writes pending for a site -> Dict(site_id, Set(Tuple(t_id, data_id, value)))
+        # writes pending for a site -> Dict(site_id, Dict(Tuple(t_id, data_id, value), None))
         self.pending_writes = dict()
 
         # Initialize all the sites:
@@ -38,8 +47,29 @@ class SiteManager:
                 last_failure_time=-100,
                 site_log=[(True, 0)]
             )
-            self.pending_reads[site_id] = set()
-            self.pending_writes[site_id] = set()
+            self.pending_reads[site_id] = dict()
+            self.pending_writes[site_id] = dict()
+
+        # version chains changed since the last checkpoint -> Dict(Tuple(site_id, data_id), index)
+        # index is the position of the first version that changed
+        self.dirty_chains: Dict[Tuple[int, str], int] = dict()
+
+        # reads served by every site -> Dict(site_id, count)
+        self.read_counts: Dict[int, int] = {site_id: 0 for site_id in range(1, 11)}
+
+        # replicated data items a recovered site still has to catch up on -> Dict(site_id, List(data_id))
+        self.catch_up_queue: Dict[int, List[str]] = dict()
+
+        # Failures injected on top of the trace (see fault_injection.py) - None: only the trace fails sites
+        # Kept here so that checkpoints carry the injector's schedule along with the site status
+        self.fault_injector: Optional[FaultInjector] = None
+
+        # Simulated time taken by site operations and commits (see latency_sim.py) - None: logical ticks only
+        self.latency: Optional[LatencySimulator] = None
+
+        # time at which a site caught up on a data item -> Dict(site_id, Dict(data_id, timestamp))
+        # From that time on the site holds every committed version of the item, until it fails again
+        self.caught_up_at: Dict[int, Dict[str, int]] = {site_id: dict() for site_id in range(1, 11)}
 
         # map of data locations: essentially it also knows where every data item is stored
         self.data_locations = {}  # Dict[str, List[int]] mapping data_id to list of site_ids
@@ -52,6 +82,15 @@ class SiteManager:
             else:  # Odd items are only at one site
                 self.data_locations[data_id] = [(i % 10) + 1]
 
+        # data items in dump order, sorted once
+        self.data_ids: List[str] = sorted(self.data_locations.keys(), key=extract_num)
+
+        # data items stored at every site, in dump order
+        self.site_data_ids: Dict[int, List[str]] = {
+            site_id: [data_id for data_id in self.data_ids if site_id in self.data_locations[data_id]]
+            for site_id in range(1, 11)
+        }
+
     def get_available_sites(self, data_id: str) -> List[int]:
         """
         Author(s):
@@ -109,9 +148,13 @@ class SiteManager:
             site_logs = self.site_status[site_id].site_log
 
             # If site was down between t_start_time and last_valid_commit_time,
-            # it is a bad site
+            # it is a bad site - unless it caught up on the versions it missed after that failure
+            caught_up_time = self.caught_up_at[site_id].get(data_id, -1)
             down_logs = [log for log in reversed(site_logs) if not log[0]]
-            down_ranged_logs = [log for log in down_logs if t_start_time > log[1] > last_valid_commit_time]
+            down_ranged_logs = [
+                log for log in down_logs
+                if t_start_time > log[1] > last_valid_commit_time and log[1] > caught_up_time
+            ]
             if down_ranged_logs:
                 continue
 
@@ -139,11 +182,21 @@ class SiteManager:
             - Rishav Roy
             - Akash Kumar Shrivastva
         """
-        for data_id in transaction.writes:
-            written_sites = self.get_available_sites(data_id)
-            for site_id in written_sites:
-                site = self.get_site(site_id)
-                site.persist(transaction.id, data_id, timestamp)
+        # data items persisted at every site -> Dict(site_id, count)
+        persisted: Dict[int, int] = dict()
+        with self.profiler.phase("persist"):
+            for data_id, value in transaction.write_buffer.items():
+                written_sites = transaction.written_sites[data_id]
+                for site_id in self.get_available_sites(data_id):
+                    # A caught up replica keeps receiving commits so that it stays complete
+                    if site_id in written_sites or self.is_caught_up(site_id, data_id):
+                        site = self.get_site(site_id)
+                        self.dirty_chains.setdefault((site_id, data_id), len(site.data_store[data_id]))
+                        site.persist(transaction.id, data_id, value, timestamp)
+                        persisted[site_id] = persisted.get(site_id, 0) + 1
+
+        if self.latency is not None:
+            self.latency.commit(transaction.id, persisted)
 
     def fail(self, site_id: int, timestamp: int):
         """
@@ -155,6 +208,7 @@ class SiteManager:
 
         self.site_status[site_id].last_failure_time = timestamp
         self.site_status[site_id].site_log.append((False, timestamp))
+        self.catch_up_queue.pop(site_id, None)
         print(f"Site {site_id} fails")
 
     def recover(self, site_id: int, timestamp: int) -> int:
@@ -166,8 +220,71 @@ class SiteManager:
         self.site_status[site_id].status = True
         self.site_status[site_id].site_log.append((True, timestamp))
         print(f"Site {site_id} recovers")
+
+        if self.catch_up_batch_size > 0:
+            self.catch_up_queue[site_id] = [
+                data_id for data_id in self.data_ids
+                if len(self.data_locations[data_id]) > 1 and site_id in self.data_locations[data_id]
+            ]
         return site_id
 
+    def is_caught_up(self, site_id: int, data_id: str) -> bool:
+        return self.caught_up_at[site_id].get(data_id, -1) > self.get_last_fail_time(site_id)
+
+    def get_first_fail_time_after(self, site_id: int, timestamp: int) -> int:
+        # A copy complete at timestamp stays complete until the first failure after it
+        for is_up, log_time in self.site_status[site_id].site_log:
+            if not is_up and log_time > timestamp:
+                return log_time
+        return self.get_last_fail_time(site_id)
+
+    def get_catch_up_peer(self, site_id: int, data_id: str) -> Optional[int]:
+        """
+        A peer can serve the catch-up of a data item only if it holds every committed version of it:
+        it is up and has either never failed or caught up on the item since its last failure
+        """
+        for peer_id in self.get_all_site_ids(data_id):
+            if peer_id == site_id or not self.is_site_up(peer_id):
+                continue
+            if self.get_last_fail_time(peer_id) < 0 or self.is_caught_up(peer_id, data_id):
+                return peer_id
+        return None
+
+    def advance_catch_up(self, timestamp: int):
+        """
+        RECOVERY CATCH-UP: every tick, each recovering site pulls the committed versions it missed
+        for the next batch of its replicated data items from an up peer. Items that are done become
+        readable right away, the rest keep following the Available Copies rule until their turn.
+        """
+        for site_id in list(self.catch_up_queue.keys()):
+            queue = self.catch_up_queue[site_id]
+            batch, self.catch_up_queue[site_id] = queue[:self.catch_up_batch_size], queue[self.catch_up_batch_size:]
+
+            for data_id in batch:
+                peer_id = self.get_catch_up_peer(site_id, data_id)
+                if peer_id is None:
+                    # No complete copy is up - the item becomes current with the next committed write
+                    continue
+
+                # Only versions committed after the copy stopped being complete can be missing,
+                # and both chains are timestamp ordered
+                fail_time = self.get_first_fail_time_after(site_id, self.caught_up_at[site_id].get(data_id, -1))
+                versions = self.get_site(site_id).data_store[data_id]
+                peer_versions = self.get_site(peer_id).data_store[data_id]
+                start = first_version_after(versions, fail_time)
+                merged, delta = merge_versions(versions[start:], peer_versions[first_version_after(peer_versions, fail_time):])
+                if delta:
+                    versions[start:] = merged
+                    key = (site_id, data_id)
+                    self.dirty_chains[key] = min(self.dirty_chains.get(key, start), start)
+                self.caught_up_at[site_id][data_id] = timestamp
+
+                if self.verbose:
+                    print(f"Site {site_id} catches up on {data_id} from site {peer_id} ({delta} missed versions)")
+
+            if not self.catch_up_queue[site_id]:
+                self.catch_up_queue.pop(site_id)
+
     def dump(self):
         """
         Author(s):
@@ -175,36 +292,93 @@ class SiteManager:
             - Akash Kumar Shrivastva
         """
 
-        print("\nSITE DUMP")
-        for site_id in range(1, 11):
-            if self.is_site_up(site_id):
-                site_dump = self.get_site(site_id).dump()
-                print(site_dump)
+        # One write for the whole dump
+        print("\n".join(["\nSITE DUMP"] + self.snapshot().format_dump()))
+
+    def snapshot(self) -> ClusterSnapshot:
+        up_sites = [site_id for site_id in sorted(self.sites.keys()) if self.is_site_up(site_id)]
+        return build_snapshot(up_sites, self.data_ids, self.site_data_ids, self.sites)
+
+    def get_queue_depth(self, site_id: int) -> int:
+        return len(self.pending_reads[site_id]) + len(self.pending_writes[site_id])
+
+    def get_queued_transactions(self, site_ids: List[int]) -> Set[str]:
+        queued = set()
+        for site_id in site_ids:
+            queued.update(op[0] for op in self.pending_reads[site_id])
+            queued.update(op[0] for op in self.pending_writes[site_id])
+        return queued
+
+    def record_read(self, site_id: int):
+        self.read_counts[site_id] += 1
+
+    def read_report(self):
+        total_reads = sum(self.read_counts.values())
+        print("\nREPLICA READS")
+        for site_id in sorted(self.read_counts.keys()):
+            count = self.read_counts[site_id]
+            share = 100 * count / total_reads if total_reads else 0
+            print(f"site {site_id} - {count} reads ({share:.1f}%)")
 
     def add_to_pending_reads(self, site_id: int, t_id: str, data_id: str):
         """
         Author(s):
             - Rishav Roy
         """
-        self.pending_reads[site_id].add((t_id, data_id))
+        self.pending_reads[site_id][(t_id, data_id)] = None
 
     def add_to_pending_writes(self, site_id: int, t_id: str, data_id: str, value: int):
         """
         Author(s):
             - Rishav Roy
         """
-        self.pending_writes[site_id].add((t_id, data_id, value))
+        self.pending_writes[site_id][(t_id, data_id, value)] = None
 
     def remove_from_pending_reads(self, site_id: int, t_id: str, data_id: str):
         """
         Author(s):
             - Rishav Roy
         """
-        self.pending_reads[site_id].discard((t_id, data_id))
+        self.pending_reads[site_id].pop((t_id, data_id), None)
 
     def remove_from_pending_writes(self, site_id: int, t_id: str, data_id: str, value: int):
         """
         Author(s):
             - Rishav Roy
         """
-        self.pending_writes[site_id].discard((t_id, data_id, value))
+        self.pending_writes[site_id].pop((t_id, data_id, value), None)
+
+    def remove_transaction_from_pending(self, t_id: str):
+        for site_id in self.pending_reads:
+            self.pending_reads[site_id] = {op: None for op in self.pending_reads[site_id] if op[0] != t_id}
+        for site_id in self.pending_writes:
+            self.pending_writes[site_id] = {op: None for op in self.pending_writes[site_id] if op[0] != t_id}
+
+
+def first_version_after(versions: List[DataLog], timestamp: int) -> int:
+    # Index of the first version committed after timestamp, scanning back from the latest one
+    idx = len(versions)
+    while idx > 0 and versions[idx - 1].timestamp > timestamp:
+        idx -= 1
+    return idx
+
+
+def merge_versions(versions: List[DataLog], peer_versions: List[DataLog]) -> Tuple[List[DataLog], int]:
+    """
+    Merges two timestamp ordered version chains, keeping the local version of a commit both hold.
+    :return: merged chain and the number of versions taken from the peer
+    """
+    merged = []
+    taken = 0
+    i = j = 0
+    while i < len(versions) or j < len(peer_versions):
+        if j == len(peer_versions) or (i < len(versions) and versions[i].timestamp <= peer_versions[j].timestamp):
+            if j < len(peer_versions) and versions[i].timestamp == peer_versions[j].timestamp:
+                j += 1
+            merged.append(versions[i])
+            i += 1
+        else:
+            merged.append(peer_versions[j])
+            taken += 1
+            j += 1
+    return merged, taken
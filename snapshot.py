@@ -0,0 +1,115 @@
+from typing import Dict, List
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the vectorized checks and the binary export
+    np = None
+
+
+class ClusterSnapshot:
+    """
+    Latest committed state of the cluster, gathered into plain Python lists.
+
+    Rows are the sites that were up when the snapshot was taken. Row r lists the data items
+    site r stores (row_data_ids[r], in dump order) with their latest committed value and
+    commit time. dump() is formatted straight from these lists; matrices() lays them out as
+    NumPy sites x data items matrices for the divergence check and the .npz export.
+    """
+
+    def __init__(
+            self,
+            site_ids: List[int],
+            data_ids: List[str],
+            row_data_ids: List[List[str]],
+            values: List[list],
+            commit_times: List[list]
+    ):
+        self.site_ids = site_ids
+        self.data_ids = data_ids
+        self.row_data_ids = row_data_ids
+        self.values = values
+        self.commit_times = commit_times
+
+    def format_dump(self) -> List[str]:
+        return [
+            f"site {site_id} - " + ", ".join([f"{data_id}: {value}" for data_id, value in zip(row_data_ids, values)])
+            for site_id, row_data_ids, values in zip(self.site_ids, self.row_data_ids, self.values)
+        ]
+
+    def matrices(self) -> tuple:
+        """
+        (values, commit_times, held) as sites x data items NumPy matrices, where held[r][c]
+        is False for the data items site r does not store (their cells hold 0).
+        """
+        require_numpy()
+        shape = (len(self.site_ids), len(self.data_ids))
+        columns = {data_id: col for col, data_id in enumerate(self.data_ids)}
+        values = np.zeros(shape, dtype=np.int64)
+        commit_times = np.zeros(shape, dtype=np.int64)
+        held = np.zeros(shape, dtype=bool)
+
+        for row, (site_id, row_data_ids) in enumerate(zip(self.site_ids, self.row_data_ids)):
+            row_columns = [columns[data_id] for data_id in row_data_ids]
+            try:
+                values[row, row_columns] = self.values[row]
+            except OverflowError:
+                info = np.iinfo(np.int64)
+                data_id, value = next(
+                    (data_id, value) for data_id, value in zip(row_data_ids, self.values[row])
+                    if not info.min <= value <= info.max
+                )
+                raise ValueError(f"{data_id} = {value} at site {site_id} does not fit a 64-bit integer matrix") from None
+            commit_times[row, row_columns] = self.commit_times[row]
+            held[row, row_columns] = True
+        return values, commit_times, held
+
+    def divergent_data_ids(self) -> List[str]:
+        """
+        Data items whose latest committed value differs between the up sites holding them.
+        Under Available Copies this is expected for replicas that have not been written
+        since their site recovered, anything else points to a replication bug.
+        """
+        if not self.site_ids:
+            return []
+
+        values, _, held = self.matrices()
+        info = np.iinfo(np.int64)
+        highest = np.where(held, values, info.min).max(axis=0)
+        lowest = np.where(held, values, info.max).min(axis=0)
+        diverged = (held.sum(axis=0) > 1) & (highest != lowest)
+        return [self.data_ids[col] for col in np.flatnonzero(diverged)]
+
+    def save(self, path: str):
+        values, commit_times, held = self.matrices()
+        np.savez_compressed(
+            path,
+            site_ids=np.asarray(self.site_ids, dtype=np.int64),
+            data_ids=np.asarray(self.data_ids),
+            values=values,
+            commit_times=commit_times,
+            held=held
+        )
+
+
+def build_snapshot(
+        site_ids: List[int],
+        data_ids: List[str],
+        site_data_ids: Dict[int, List[str]],
+        sites: dict
+) -> ClusterSnapshot:
+    # Gather the latest version of every data item of every given site in a single pass over the chains
+    row_data_ids = []
+    values = []
+    commit_times = []
+    for site_id in site_ids:
+        data_store = sites[site_id].data_store
+        latest = [data_store[data_id][-1] for data_id in site_data_ids[site_id]]
+        row_data_ids.append(site_data_ids[site_id])
+        values.append([version.value for version in latest])
+        commit_times.append([version.timestamp for version in latest])
+    return ClusterSnapshot(site_ids, data_ids, row_data_ids, values, commit_times)
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for snapshot export and divergence checks - pip install numpy")
@@ -0,0 +1,55 @@
+import math
+import random
+from typing import List
+
+
+class Distribution:
+    """
+    Random duration sampled from one of a few common failure / repair / service time models.
+    shape is the Weibull shape parameter or the lognormal sigma, ignored by the other kinds.
+    """
+
+    KINDS = ("fixed", "uniform", "exponential", "weibull", "lognormal")
+
+    def __init__(self, kind: str = "exponential", mean: float = 100, shape: float = 1.0):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown distribution: {kind} (expected one of {', '.join(self.KINDS)})")
+        if mean <= 0 or shape <= 0:
+            raise ValueError("Distribution mean and shape must be positive")
+
+        self.kind = kind
+        self.mean = mean
+        self.shape = shape
+
+    @classmethod
+    def from_config(cls, config) -> "Distribution":
+        # A bare number is the mean of an exponential distribution
+        if isinstance(config, (int, float)):
+            return cls("exponential", config)
+        return cls(config.get("distribution", "exponential"), config["mean"], config.get("shape", 1.0))
+
+    def sample(self, rng: random.Random) -> int:
+        # Whole logical ticks, at least one
+        return max(1, round(self.draw(rng)))
+
+    def draw(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            value = self.mean
+        elif self.kind == "uniform":
+            value = rng.uniform(0, 2 * self.mean)
+        elif self.kind == "exponential":
+            value = rng.expovariate(1 / self.mean)
+        elif self.kind == "weibull":
+            # scale chosen so that the distribution keeps the configured mean
+            value = rng.weibullvariate(self.mean / math.gamma(1 + 1 / self.shape), self.shape)
+        else:
+            value = rng.lognormvariate(math.log(self.mean) - self.shape ** 2 / 2, self.shape)
+        return value
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile over an already sorted list
+    if not sorted_values:
+        return 0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
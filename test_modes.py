@@ -0,0 +1,174 @@
+"""
+Behaviour checks of the optional modes that a single golden output cannot express:
+--eager against the default mode, --resume against an uninterrupted run and the blocking policies.
+
+Run with: python -m unittest test_modes
+"""
+
+import contextlib
+import io
+import os
+import re
+import tempfile
+import unittest
+from typing import Callable, Dict, List, Tuple
+
+from checkpoint import Checkpointer
+from contention import ContentionAnalyzer
+from data_models import AbortType, BlockingPolicy, TransactionStatus
+from driver import Driver
+from fault_injection import load_fault_injector
+from latency_sim import load_latency_simulator
+from replica_selection import make_replica_selector
+from retry import RetryEngine
+from trace_reader import iter_commands
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input")
+
+OUTCOME = re.compile(r"^(T\d+) (commits|aborts)$", re.MULTILINE)
+
+# Driver options of every mode -> Driver keyword arguments, built afresh for every run
+MODES: Dict[str, Callable[[], dict]] = {
+    "default": lambda: {},
+    "--eager": lambda: {"eager_validation": True},
+    "--catch-up": lambda: {"catch_up_batch_size": 1},
+    "--replica-policy round-robin": lambda: {"replica_selector": make_replica_selector("round-robin")},
+    "--replica-policy two-choices": lambda: {"replica_selector": make_replica_selector("two-choices", 3)},
+    "--max-wait 2 --max-queue-depth 2 --wait-die": lambda: {"blocking_policy": BlockingPolicy(2, 2, True)},
+    "--retry 2": lambda: {"retry_engine": RetryEngine(2, 1)},
+    "--faults": lambda: {"fault_injector": load_fault_injector(os.path.join(INPUT_DIR, "faults.json"))},
+    "--contention": lambda: {"contention": ContentionAnalyzer(3)},
+    "--latency": lambda: {"latency": load_latency_simulator(os.path.join(INPUT_DIR, "latency.json"))},
+}
+
+
+def trace_paths(with_options: bool = False) -> List[str]:
+    # Golden inputs, without the ones written for a specific option unless asked for
+    paths = []
+    for name in sorted(os.listdir(INPUT_DIR)):
+        path = os.path.join(INPUT_DIR, name)
+        if not name.startswith("input"):
+            continue
+        with open(path) as file:
+            if with_options or not file.readline().startswith("// options:"):
+                paths.append(path)
+    return paths
+
+
+def run_commands(driver: Driver, commands: List[str], first_timestamp: int = 1) -> List[str]:
+    # Output of every command, in order
+    outputs = []
+    for timestamp, command in enumerate(commands, first_timestamp):
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            driver.run([command], timestamp)
+        outputs.append(buffer.getvalue())
+    return outputs
+
+
+def run_reports(driver: Driver) -> str:
+    # End of run reports, in the order driver.py prints them
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        if driver.tm.replica_selector is not None:
+            driver.sm.read_report()
+        if driver.tm.blocking_policy.is_enabled():
+            driver.tm.blocking_report()
+        if driver.tm.retry_engine is not None:
+            driver.tm.retry_engine.report(driver.clock)
+        if driver.sm.fault_injector is not None:
+            driver.sm.fault_injector.report()
+        if driver.tm.contention is not None:
+            driver.tm.contention.report()
+        if driver.sm.latency is not None:
+            driver.sm.latency.report()
+    return buffer.getvalue()
+
+
+def outcomes(outputs: List[str]) -> Dict[str, Tuple[str, int]]:
+    # t_id -> (last outcome, index of the command that printed it)
+    result = {}
+    for index, output in enumerate(outputs):
+        for t_id, outcome in OUTCOME.findall(output):
+            result[t_id] = (outcome, index)
+    return result
+
+
+class EagerValidationTest(unittest.TestCase):
+    def test_same_outcomes_with_earlier_aborts(self):
+        earlier_aborts = 0
+        for path in trace_paths() + [os.path.join(INPUT_DIR, "input27")]:
+            commands = list(iter_commands(path))
+            default = outcomes(run_commands(Driver(False), commands))
+            eager = outcomes(run_commands(Driver(False, eager_validation=True), commands))
+            with self.subTest(trace=os.path.basename(path)):
+                self.assertEqual(
+                    {t_id: outcome for t_id, (outcome, _) in default.items()},
+                    {t_id: outcome for t_id, (outcome, _) in eager.items()}
+                )
+                for t_id, (outcome, index) in eager.items():
+                    self.assertLessEqual(index, default[t_id][1], f"{t_id} {outcome} later with --eager")
+                    earlier_aborts += index < default[t_id][1]
+        self.assertGreater(earlier_aborts, 0)
+
+
+class ResumeTest(unittest.TestCase):
+    EVERY = 2
+
+    def test_resumed_run_matches_uninterrupted_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, "checkpoint")
+            for mode, options in MODES.items():
+                for path in trace_paths(with_options=True):
+                    commands = list(iter_commands(path))
+                    # Interrupted right after a checkpoint, two thirds into the trace
+                    stop = max(self.EVERY, len(commands) * 2 // 3 // self.EVERY * self.EVERY)
+                    if stop >= len(commands):
+                        continue
+
+                    driver = Driver(False, **options())
+                    expected = "".join(run_commands(driver, commands)) + run_reports(driver)
+
+                    first = Driver(False, **options())
+                    first.checkpointer = Checkpointer(checkpoint_path, self.EVERY, first.sm, first.tm)
+                    interrupted = "".join(run_commands(first, commands[:stop]))
+
+                    resumed = Driver(False, **options())
+                    start_at, _ = resumed.resume(checkpoint_path)
+                    actual = interrupted + "".join(run_commands(resumed, commands[start_at - 1:], start_at))
+                    actual += run_reports(resumed)
+
+                    with self.subTest(mode=mode, trace=os.path.basename(path)):
+                        self.assertEqual(start_at, stop + 1)
+                        self.assertEqual(expected, actual)
+
+
+class BlockingPolicyTest(unittest.TestCase):
+    def run_trace(self, name: str, blocking_policy: BlockingPolicy) -> Driver:
+        driver = Driver(False, blocking_policy=blocking_policy)
+        run_commands(driver, list(iter_commands(os.path.join(INPUT_DIR, name))))
+        return driver
+
+    def test_transaction_waiting_past_max_wait_aborts(self):
+        # T1 waits for site 4 from its read on: it is served once the site recovers unless it gives up first
+        self.assertEqual(self.run_trace("input28", BlockingPolicy()).tm.transaction_map["T1"].status,
+                         TransactionStatus.COMMITTED)
+
+        driver = self.run_trace("input28", BlockingPolicy(max_wait=1))
+        self.assertEqual(driver.tm.transaction_map["T1"].status, TransactionStatus.ABORTED)
+        self.assertEqual(driver.tm.abort_counts[AbortType.WAIT_TIMEOUT], 1)
+        self.assertEqual(driver.tm.transaction_map["T3"].status, TransactionStatus.COMMITTED)
+
+    def test_full_queue_and_younger_waiter_abort(self):
+        for policy, abort_type in ((BlockingPolicy(max_queue_depth=2), AbortType.QUEUE_OVERFLOW),
+                                   (BlockingPolicy(wait_die=True), AbortType.WAIT_DIE)):
+            with self.subTest(abort_type=abort_type):
+                driver = self.run_trace("input29", policy)
+                self.assertEqual(driver.tm.abort_counts[abort_type], 1)
+                self.assertEqual(driver.tm.transaction_map["T3"].status, TransactionStatus.ABORTED)
+                for t_id in ("T1", "T2"):
+                    self.assertEqual(driver.tm.transaction_map[t_id].status, TransactionStatus.COMMITTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import mmap
+import os
+from typing import Iterator, Optional, Tuple
+
+
+def parse_command(raw_line: bytes) -> Optional[str]:
+    # Same rules as the original reader: skip blank and "//" lines, drop trailing comments
+    stripped_line = raw_line.strip()
+    if not stripped_line or stripped_line.startswith(b"//"):
+        return None
+    return stripped_line.split(b"//")[0].strip().decode()
+
+
+def scan_lines(mapped: mmap.mmap, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    # Yields (offset, raw line) for every line starting in [start, end), without copying the file
+    position = start
+    while position < end:
+        newline = mapped.find(b"\n", position)
+        if newline == -1:
+            newline = len(mapped)
+        yield position, mapped[position:newline]
+        position = newline + 1
+
+
+def open_mapped(path: str) -> Optional[mmap.mmap]:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_commands(path: str, start: int = 0) -> Iterator[str]:
+    """
+    Lazily yields the commands of a trace file, scanning it in place through mmap.
+    start is a byte offset (see find_command_offset) to replay the file from a given command on.
+    """
+    mapped = open_mapped(path)
+    if mapped is None:
+        return
+
+    with mapped:
+        for _, raw_line in scan_lines(mapped, start, len(mapped)):
+            command = parse_command(raw_line)
+            if command is not None:
+                yield command
+
+
+def find_command_offset(path: str, timestamp: int) -> Optional[int]:
+    # Byte offset of the command with the given timestamp (1-based), scanning forward only as far as it
+    # None when the trace holds fewer commands
+    mapped = open_mapped(path)
+    if mapped is None:
+        return None
+
+    with mapped:
+        seen = 0
+        for offset, raw_line in scan_lines(mapped, 0, len(mapped)):
+            if parse_command(raw_line) is not None:
+                seen += 1
+                if seen == timestamp:
+                    return offset
+    return None
@@ -1,11 +1,26 @@
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
+from contention import ContentionAnalyzer
 from data_models import *
+from profiler import Profiler
+from replica_selection import ReplicaSelector
+from retry import RetryEngine
 from site_manager import SiteManager
+from validation_index import ReaderWriterIndex
 
 
 class TransactionManager:
-    def __init__(self, site_manager: SiteManager, verbose: bool):
+    def __init__(
+            self,
+            site_manager: SiteManager,
+            verbose: bool,
+            profiler: Profiler = None,
+            eager_validation: bool = False,
+            replica_selector: ReplicaSelector = None,
+            blocking_policy: BlockingPolicy = None,
+            retry_engine: RetryEngine = None,
+            contention: ContentionAnalyzer = None
+    ):
         """
         Author(s):
             - Rishav Roy
@@ -13,6 +28,23 @@ class TransactionManager:
         """
         self.site_manager = site_manager
         self.verbose = verbose
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        # Eager validation marks transactions that can no longer commit as soon as
+        # a conflicting commit or a site failure happens, instead of waiting for end()
+        self.eager_validation = eager_validation
+
+        # Order in which the replicas of a data item are tried for reads
+        self.replica_selector = replica_selector if replica_selector is not None else ReplicaSelector()
+
+        # When a transaction parked in the waiting set gets aborted instead of waiting for a recovery
+        self.blocking_policy = blocking_policy if blocking_policy is not None else BlockingPolicy()
+
+        # Re-runs transactions aborted for a retriable reason - None keeps aborts terminal
+        self.retry_engine = retry_engine
+
+        # Per data item and per edge type contention statistics - None skips the bookkeeping
+        self.contention = contention
 
         # storage to store transaction information
         self.transaction_map: Dict[str, Transaction] = {}
@@ -24,6 +56,38 @@ class TransactionManager:
         # Dict of waiting transactions and the corresponding count of instructions to be executed
         self.waiting_set: Dict[str, int] = dict()
 
+        # Time at which a waiting transaction entered the waiting set -> Dict[str, int]
+        self.wait_since: Dict[str, int] = dict()
+
+        # Ended waits (served or released): count, total and longest wait in logical ticks
+        self.wait_stats: Dict[str, int] = {"waits": 0, "total_ticks": 0, "max_ticks": 0}
+
+        # Number of committed transactions
+        self.commit_count = 0
+
+        # Number of aborts of every type -> Dict[AbortType, int]
+        self.abort_counts: Dict[AbortType, int] = {abort_type: 0 for abort_type in AbortType}
+
+        # Transactions marked for abort by eager validation -> Dict[str, Tuple[AbortType, site_id, data_id]]
+        self.doomed: Dict[str, Tuple[AbortType, Optional[int], Optional[str]]] = dict()
+
+        # Readers, writers and last commit time of every data item
+        self.validation_index = ReaderWriterIndex()
+
+        # Transactions (and their conflict graph nodes) changed since the last checkpoint
+        self.dirty_transactions: Set[str] = set()
+
+        # Order in which transactions began -> Dict[str, int]
+        # Validation visits candidate transactions in this order, like a scan of transaction_map would
+        self.begin_order: Dict[str, int] = dict()
+
+        # Transactions that began and have not committed or aborted yet
+        self.active_transactions: Set[str] = set()
+
+        # Changes to the conflict graph since the last checkpoint, only recorded while checkpointing
+        # Format: [("add" / "remove", EdgeType, target t_id, [source t_id])] or [("clear", None, t_id, [])]
+        self.graph_changes: Optional[List[tuple]] = None
+
     def begin(self, t_id: str, timestamp: int):
         """
         Author(s):
@@ -40,9 +104,15 @@ class TransactionManager:
             is_read_only=True,
             commit_time=-1
         )
-        self.conflict_graph[t_id] = dict()
+        self.clear_conflict_graph_node(t_id)
+        self.begin_order.setdefault(t_id, len(self.begin_order))
+        self.active_transactions.add(t_id)
+        self.dirty_transactions.add(t_id)
         print(f"{t_id} begins")
 
+        if self.site_manager.latency is not None:
+            self.site_manager.latency.begin(t_id)
+
     def read(
             self,
             t_id: str,
@@ -56,12 +126,14 @@ class TransactionManager:
             - Akash Kumar Shrivastva
         """
 
-        if self.is_invalid(t_id):
+        if self.is_invalid(t_id) or self.rejects_doomed(t_id, timestamp):
             return
 
         transaction = self.transaction_map[t_id]
+        self.dirty_transactions.add(t_id)
 
-        previously_running_sites = self.site_manager.get_previously_running_sites(data_id, transaction)
+        with self.profiler.phase("available_copies"):
+            previously_running_sites = self.site_manager.get_previously_running_sites(data_id, transaction)
 
         # ABORT if it is an impossible read - (Based on Available Copies)
         if not previously_running_sites:
@@ -69,13 +141,16 @@ class TransactionManager:
             return
 
         # Get available sites for this data item
-        available_sites = self.site_manager.get_available_sites(data_id)
-        read_ready_sites = [site for site in available_sites if site in previously_running_sites]
+        with self.profiler.phase("available_copies"):
+            available_sites = self.site_manager.get_available_sites(data_id)
+            read_ready_sites = [site for site in available_sites if site in previously_running_sites]
 
         # Move the transaction to the waiting set
         if not read_ready_sites:
+            if self.rejects_blocking(t_id, previously_running_sites, timestamp):
+                return
             print(f"No sites available - Moving (R,{t_id},{data_id}) to pending reads")
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) + 1
+            self.start_waiting(t_id, timestamp)
             for site_id in previously_running_sites:
                 self.site_manager.add_to_pending_reads(site_id, t_id, data_id)
             return
@@ -83,20 +158,29 @@ class TransactionManager:
         # Do not process a waiting transaction
         # But make sure it is not an already waiting transaction trying to read from the DB
         if t_id in self.waiting_set and not is_pending_read:
+            if self.rejects_blocking(t_id, previously_running_sites, timestamp):
+                return
             print(f"{t_id} is currently waiting - Moving (R,{t_id},{data_id}) to pending reads")
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) + 1
+            self.start_waiting(t_id, timestamp)
             for site_id in previously_running_sites:
                 self.site_manager.add_to_pending_reads(site_id, t_id, data_id)
             return
 
         # Try to read from any of the read ready sites
         success = False
-        for site_id in read_ready_sites:
-            value = self.site_manager.get_site(site_id).read(data_id, transaction.start_time)
+        for site_id in self.replica_selector.order(data_id, read_ready_sites, self.site_manager):
+            with self.profiler.phase("version_scan"):
+                value = self.site_manager.get_site(site_id).read(data_id, transaction.start_time)
 
             if value is not None:
                 transaction.reads.add(data_id)
                 transaction.sites_accessed.append((site_id, Operations.READ, timestamp))
+                self.validation_index.record_read(data_id, t_id)
+                self.site_manager.record_read(site_id)
+                if self.contention is not None:
+                    self.contention.record_read(data_id)
+                if self.site_manager.latency is not None:
+                    self.site_manager.latency.read(t_id, site_id)
 
                 if self.verbose:
                     print(f"{t_id} reads {value} from committed {data_id} at site {site_id}")
@@ -110,9 +194,7 @@ class TransactionManager:
 
         # Remove the read from pending reads
         if success and is_pending_read:
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) - 1
-            if self.waiting_set[t_id] <= 0:
-                self.waiting_set.pop(t_id, None)
+            self.stop_waiting(t_id, timestamp)
 
             for site_id in read_ready_sites:
                 self.site_manager.remove_from_pending_reads(site_id, t_id, data_id)
@@ -131,10 +213,11 @@ class TransactionManager:
             - Akash Kumar Shrivastva
         """
 
-        if self.is_invalid(t_id):
+        if self.is_invalid(t_id) or self.rejects_doomed(t_id, timestamp):
             return
 
         transaction = self.transaction_map[t_id]
+        self.dirty_transactions.add(t_id)
 
         # Mark the transaction as a read-write transaction.
         # Useful for Available Copies Algorithm.
@@ -142,13 +225,16 @@ class TransactionManager:
             transaction.is_read_only = False
 
         # Get available sites for this data item
-        available_sites = self.site_manager.get_available_sites(data_id)
+        with self.profiler.phase("available_copies"):
+            available_sites = self.site_manager.get_available_sites(data_id)
 
         # Move the transaction to the waiting set
         if not available_sites:
-            print(f"No sites available - Moving (W,{t_id},{data_id},{value}) to pending writes")
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) + 1
             writable_sites = self.site_manager.get_all_site_ids(data_id)
+            if self.rejects_blocking(t_id, writable_sites, timestamp):
+                return
+            print(f"No sites available - Moving (W,{t_id},{data_id},{value}) to pending writes")
+            self.start_waiting(t_id, timestamp)
             for site_id in writable_sites:
                 self.site_manager.add_to_pending_writes(site_id, t_id, data_id, value)
             return
@@ -156,9 +242,11 @@ class TransactionManager:
         # Do not process a waiting transaction
         # But make sure it is not an already waiting transaction trying to write to the DB
         if t_id in self.waiting_set and not is_pending_write:
-            print(f"{t_id} is currently waiting - Moving (W,{t_id},{data_id},{value}) to pending writes")
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) + 1
             writable_sites = self.site_manager.get_all_site_ids(data_id)
+            if self.rejects_blocking(t_id, writable_sites, timestamp):
+                return
+            print(f"{t_id} is currently waiting - Moving (W,{t_id},{data_id},{value}) to pending writes")
+            self.start_waiting(t_id, timestamp)
             for site_id in writable_sites:
                 self.site_manager.add_to_pending_writes(site_id, t_id, data_id, value)
             return
@@ -177,9 +265,7 @@ class TransactionManager:
 
         # Remove from pending writes
         if success and is_pending_write:
-            self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) - 1
-            if self.waiting_set[t_id] <= 0:
-                self.waiting_set.pop(t_id, None)
+            self.stop_waiting(t_id, timestamp)
 
             writable_sites = self.site_manager.get_all_site_ids(data_id)
             for site_id in writable_sites:
@@ -190,6 +276,19 @@ class TransactionManager:
 
             transaction = self.transaction_map[t_id]
             transaction.writes.add(data_id)
+            transaction.write_buffer[data_id] = value
+            transaction.written_sites.setdefault(data_id, set()).update(success_sites)
+            self.validation_index.record_write(data_id, t_id)
+            if self.contention is not None:
+                self.contention.record_write(data_id)
+            if self.site_manager.latency is not None:
+                self.site_manager.latency.write(t_id, success_sites)
+
+            # A concurrent transaction already committed this data item - first committer rule will fail
+            if self.eager_validation:
+                last_commit_time = self.validation_index.last_commit_time.get(data_id, -1)
+                if last_commit_time > transaction.start_time:
+                    self.mark_doomed(t_id, AbortType.FIRST_COMMITTER_WRITE, data_id=data_id)
 
     def clears_site_failure_check(self, t_id: str) -> bool:
         """
@@ -235,7 +334,7 @@ class TransactionManager:
 
         return True
 
-    def clears_first_committer_rule_check(self, t_id: str) -> bool:
+    def clears_first_committer_rule_check(self, t_id: str, candidates: dict) -> bool:
         """
         Author(s):
             - Rishav Roy
@@ -274,20 +373,33 @@ class TransactionManager:
 
         for data_id in transaction.writes:
 
+            # Nothing was committed to this data item since T began - no version to scan
+            if data_id not in candidates["committed_since_start"]:
+                continue
+
             site_ids = self.site_manager.get_available_sites(data_id)
 
-            for site_id in site_ids:
-                logs = self.site_manager.get_committed_logs_from_site_for_data_id(site_id, data_id)
-                for log in logs:
-                    if log.committed and log.transaction_id != t_id and log.timestamp > transaction.start_time:
-                        self.abort_transaction(AbortType.FIRST_COMMITTER_WRITE, t_id)
-                        return False
+            with self.profiler.phase("version_scan"):
+                conflict = self.has_concurrent_commit(t_id, data_id, site_ids)
+
+            if conflict:
+                self.abort_transaction(AbortType.FIRST_COMMITTER_WRITE, t_id, data_id=data_id)
+                return False
 
         if self.verbose:
             print(f"{t_id} passes the 1st committer check")
 
         return True
 
+    def has_concurrent_commit(self, t_id: str, data_id: str, site_ids: List[int]) -> bool:
+        transaction = self.transaction_map[t_id]
+        for site_id in site_ids:
+            logs = self.site_manager.get_committed_logs_from_site_for_data_id(site_id, data_id)
+            for log in logs:
+                if log.committed and log.transaction_id != t_id and log.timestamp > transaction.start_time:
+                    return True
+        return False
+
     def abort_transaction(self, abort_type: AbortType, t_id: str, data_id: str = None, site_id: int = None):
         """
         Author(s):
@@ -303,11 +415,48 @@ class TransactionManager:
                 print(f"Aborting {t_id} as site {site_id} failed since it first wrote to it")
             if AbortType.CONSECUTIVE_RW_CYCLE == abort_type:
                 print(f"Aborting {t_id} due to consecutive read-write cycle in the conflict graph")
+            if AbortType.WAIT_TIMEOUT == abort_type:
+                print(f"Aborting {t_id} as it waited longer than {self.blocking_policy.max_wait} ticks")
+            if AbortType.QUEUE_OVERFLOW == abort_type:
+                print(f"Aborting {t_id} as the pending queue of a site it needs is full")
+            if AbortType.WAIT_DIE == abort_type:
+                print(f"Aborting {t_id} as it is younger than a transaction already waiting (wait-die)")
 
         transaction = self.transaction_map[t_id]
         transaction.status = TransactionStatus.ABORTED
+        self.active_transactions.discard(t_id)
+        self.dirty_transactions.add(t_id)
+        self.abort_counts[abort_type] += 1
+        transaction.write_buffer.clear()
+        transaction.written_sites.clear()
         print(f"{t_id} aborts")
 
+        if self.contention is not None:
+            self.contention.record_abort(t_id, abort_type, data_id)
+
+        if self.site_manager.latency is not None:
+            self.site_manager.latency.finish(t_id, False)
+
+        if self.retry_engine is not None:
+            self.retry_engine.on_abort(t_id, abort_type, self.count_contenders(t_id))
+
+    def count_contenders(self, t_id: str) -> int:
+        # Active transactions writing any data item t_id read or wrote - the ones it would conflict with again
+        transaction = self.transaction_map[t_id]
+        contenders = set()
+        for data_id in transaction.reads | transaction.writes:
+            contenders.update(self.validation_index.writers.get(data_id, ()))
+        contenders.discard(t_id)
+        return sum(
+            1 for contender_id in contenders
+            if self.transaction_map[contender_id].status == TransactionStatus.ACTIVE
+        )
+
+    def prepare_retry(self, t_id: str, timestamp: int):
+        # Drop what the aborted incarnation left behind before begin() runs it again
+        self.release_pending(t_id, timestamp)
+        self.doomed.pop(t_id, None)
+
     def end(self, t_id: str, timestamp: int):
         """
         Author(s):
@@ -315,40 +464,198 @@ class TransactionManager:
             - Akash Kumar Shrivastva
         """
 
-        if self.is_invalid(t_id):
+        if self.is_invalid(t_id) or self.rejects_doomed(t_id, timestamp):
             return
 
+        if self.contention is not None:
+            self.contention.start_validation(t_id)
+
+        # Collect the validation state of every data item T touched
+        transaction = self.transaction_map[t_id]
+        self.dirty_transactions.add(t_id)
+        candidates = self.validation_index.lookup(transaction.reads, transaction.writes, transaction.start_time)
+
         # Check for ABORT based on Available Copies
-        if not self.clears_site_failure_check(t_id):
+        with self.profiler.phase("available_copies"):
+            site_failure_check = self.clears_site_failure_check(t_id)
+        if not site_failure_check:
             return
 
         # Check for ABORT based on First committer rule in Snapshot Isolation
-        if not self.clears_first_committer_rule_check(t_id):
+        if not self.clears_first_committer_rule_check(t_id, candidates):
             return
 
         # Check for ABORT based on Consecutive RW edges in Serialization Graph
-        if not self.update_conflict_graph(t_id, timestamp):
+        with self.profiler.phase("conflict_graph"):
+            conflict_graph_check = self.update_conflict_graph(t_id, timestamp, candidates)
+        if not conflict_graph_check:
             return
 
         # Commit after above checks
-        transaction = self.transaction_map[t_id]
         self.site_manager.commit(transaction, timestamp)
+        self.validation_index.record_commit(transaction.writes, timestamp)
         transaction.status = TransactionStatus.COMMITTED
+        self.active_transactions.discard(t_id)
         transaction.commit_time = timestamp
+        self.commit_count += 1
+        transaction.write_buffer.clear()
+        transaction.written_sites.clear()
         print(f"{t_id} commits")
 
+        if self.site_manager.latency is not None:
+            self.site_manager.latency.finish(t_id, True)
+
+        if self.retry_engine is not None:
+            self.retry_engine.on_commit(t_id)
+
+        if self.eager_validation:
+            self.mark_first_committer_conflicts(t_id, timestamp)
+
     def exec_pending(self, site_id: int, timestamp: int):
         """
         Author(s):
             - Rishav Roy
         """
-        pending_reads = self.site_manager.pending_reads[site_id].copy()
-        pending_writes = self.site_manager.pending_writes[site_id].copy()
+        pending_reads = list(self.site_manager.pending_reads[site_id])
+        pending_writes = list(self.site_manager.pending_writes[site_id])
         for t_id, data_id in pending_reads:
+            # skip operations released while executing the previous ones
+            if (t_id, data_id) not in self.site_manager.pending_reads[site_id]:
+                continue
             self.read(t_id, data_id, timestamp, True)
         for t_id, data_id, value in pending_writes:
+            if (t_id, data_id, value) not in self.site_manager.pending_writes[site_id]:
+                continue
             self.write(t_id, data_id, value, timestamp, True)
 
+    def mark_doomed(self, t_id: str, abort_type: AbortType, site_id: int = None, data_id: str = None):
+        if t_id in self.doomed:
+            return
+        self.doomed[t_id] = (abort_type, site_id, data_id)
+        if self.verbose:
+            print(f"{t_id} can no longer commit ({abort_type.value}) - marking it for abort")
+
+    def mark_first_committer_conflicts(self, t_id: str, timestamp: int):
+        """
+        EAGER VALIDATION: After T commits, every active transaction that began before
+        the commit and has written a data item T wrote will fail the first committer rule
+        """
+        committed_writes = self.transaction_map[t_id].writes
+
+        # Only the transactions that wrote one of the committed items can conflict
+        writer_ids = set()
+        for data_id in committed_writes:
+            writer_ids.update(self.validation_index.writers.get(data_id, ()))
+
+        for writer_id in sorted(writer_ids & self.active_transactions, key=self.begin_order.__getitem__):
+            transaction = self.transaction_map[writer_id]
+            if transaction.id in self.doomed:
+                continue
+            conflicts = transaction.writes & committed_writes
+            if transaction.start_time < timestamp and conflicts:
+                self.mark_doomed(transaction.id, AbortType.FIRST_COMMITTER_WRITE, data_id=min(conflicts))
+
+    def mark_site_failure_victims(self, site_id: int, timestamp: int):
+        """
+        EAGER VALIDATION: Every active transaction that wrote to a site before
+        it failed will fail the Available Copies check at commit time
+        """
+        if not self.eager_validation:
+            return
+
+        for active_id in sorted(self.active_transactions, key=self.begin_order.__getitem__):
+            transaction = self.transaction_map[active_id]
+            if transaction.id in self.doomed:
+                continue
+            for accessed_site_id, operation, ts in transaction.sites_accessed:
+                if accessed_site_id == site_id and operation == Operations.WRITE and ts < timestamp:
+                    self.mark_doomed(transaction.id, AbortType.SITE_FAILURE, site_id)
+                    break
+
+    def rejects_doomed(self, t_id: str, timestamp: int) -> bool:
+        if t_id not in self.doomed:
+            return False
+
+        # Abort right away and release everything the transaction is holding
+        abort_type, site_id, data_id = self.doomed.pop(t_id)
+        self.release_pending(t_id, timestamp)
+        self.abort_transaction(abort_type, t_id, data_id, site_id)
+        return True
+
+    def start_waiting(self, t_id: str, timestamp: int):
+        self.waiting_set[t_id] = self.waiting_set.get(t_id, 0) + 1
+        self.wait_since.setdefault(t_id, timestamp)
+
+    def stop_waiting(self, t_id: str, timestamp: int, release_all: bool = False):
+        # One pending instruction of t_id went through - or all of them were released
+        self.waiting_set[t_id] = 0 if release_all else self.waiting_set.get(t_id, 0) - 1
+        if self.waiting_set[t_id] > 0:
+            return
+
+        self.waiting_set.pop(t_id, None)
+        if t_id in self.wait_since:
+            waited = timestamp - self.wait_since.pop(t_id)
+            self.wait_stats["waits"] += 1
+            self.wait_stats["total_ticks"] += waited
+            self.wait_stats["max_ticks"] = max(self.wait_stats["max_ticks"], waited)
+
+    def release_pending(self, t_id: str, timestamp: int):
+        if t_id in self.waiting_set:
+            self.stop_waiting(t_id, timestamp, release_all=True)
+        self.site_manager.remove_transaction_from_pending(t_id)
+
+    def rejects_blocking(self, t_id: str, site_ids: List[int], timestamp: int) -> bool:
+        """
+        BLOCKING POLICY: decide whether t_id may be queued at site_ids.
+        - max queue depth: a site already holding that many pending operations takes no more
+        - wait-die: a transaction younger than one already queued at the site dies instead of waiting
+        """
+        policy = self.blocking_policy
+        abort_type = None
+
+        if policy.max_queue_depth is not None:
+            if any(self.site_manager.get_queue_depth(site_id) >= policy.max_queue_depth for site_id in site_ids):
+                abort_type = AbortType.QUEUE_OVERFLOW
+
+        if abort_type is None and policy.wait_die:
+            start_time = self.transaction_map[t_id].start_time
+            for queued_id in self.site_manager.get_queued_transactions(site_ids):
+                queued = self.transaction_map[queued_id]
+                if queued_id != t_id and queued.status == TransactionStatus.ACTIVE and queued.start_time < start_time:
+                    abort_type = AbortType.WAIT_DIE
+                    break
+
+        if abort_type is None:
+            return False
+
+        self.release_pending(t_id, timestamp)
+        self.abort_transaction(abort_type, t_id)
+        return True
+
+    def enforce_wait_timeouts(self, timestamp: int):
+        # BLOCKING POLICY: abort transactions that have been waiting for more than max_wait ticks
+        max_wait = self.blocking_policy.max_wait
+        if max_wait is None:
+            return
+
+        expired = [t_id for t_id, since in self.wait_since.items() if timestamp - since > max_wait]
+        for t_id in expired:
+            if self.transaction_map[t_id].status != TransactionStatus.ACTIVE:
+                # Aborted while waiting by some other rule - only its queue entries are left
+                self.release_pending(t_id, timestamp)
+                continue
+            self.release_pending(t_id, timestamp)
+            self.abort_transaction(AbortType.WAIT_TIMEOUT, t_id)
+
+    def blocking_report(self):
+        waits = self.wait_stats["waits"]
+        mean_wait = self.wait_stats["total_ticks"] / waits if waits else 0
+        print("\nBLOCKING REPORT")
+        print(f"waits ended: {waits}, mean wait: {mean_wait:.2f} ticks, longest wait: {self.wait_stats['max_ticks']} ticks")
+        print(f"still waiting: {len(self.waiting_set)}")
+        for abort_type in (AbortType.WAIT_TIMEOUT, AbortType.QUEUE_OVERFLOW, AbortType.WAIT_DIE):
+            print(f"aborts by {abort_type.value}: {self.abort_counts[abort_type]}")
+
     def is_invalid(self, t_id: str) -> bool:
         """
         Author(s):
@@ -365,7 +672,7 @@ class TransactionManager:
 
         return False
 
-    def update_conflict_graph(self, t_id: str, timestamp: int) -> bool:
+    def update_conflict_graph(self, t_id: str, timestamp: int, candidates: dict) -> bool:
         """
         Author(s):
             - Rishav Roy
@@ -377,19 +684,36 @@ class TransactionManager:
         # remove T' and all associated edges from  the serialization graph,
         # otherwise commit T' and leave
         # it in the serialization graph.
-        success = True
-        if success:
-            success = self.add_ww_edge(t_id)
-        if success:
-            success = self.add_wr_edge(t_id)
-        if success:
-            success = self.add_rw_edge(t_id, timestamp)
+        self.add_ww_edge(t_id, candidates["writers_of_writes"])
+        self.add_wr_edge(t_id, candidates["writers_of_reads"])
+        self.add_rw_edge(t_id, timestamp, candidates["readers_of_writes"])
+
+        # Edges are added optimistically and validated once: they all end at T', and adding
+        # edges never removes a cycle, so checking after the last one gives the same verdict
+        # as checking after each of them
+        if self.has_rw_edge_cycle(t_id):
+            self.remove_transaction_from_conflict_graph(t_id)
+            self.abort_transaction(AbortType.CONSECUTIVE_RW_CYCLE, t_id)
+            return False
 
-        if success and self.verbose:
+        if self.verbose:
             print(f"{t_id} passes the back-to-back RW edge cycle check")
-        return success
+        return True
+
+    def get_candidate_transactions(self, candidate_ids: Set[str]) -> List[Transaction]:
+        ordered_ids = sorted(candidate_ids, key=self.begin_order.__getitem__)
+        return [self.transaction_map[candidate_id] for candidate_id in ordered_ids]
+
+    def log_graph_change(self, change: str, edge_type: Optional[EdgeType], t_id: str, source_ids: List[str]):
+        if self.graph_changes is not None and (source_ids or change == "clear"):
+            self.graph_changes.append((change, edge_type, t_id, source_ids))
+
+    def clear_conflict_graph_node(self, t_id: str):
+        # Drops the outgoing edges of t_id
+        self.conflict_graph[t_id] = dict()
+        self.log_graph_change("clear", None, t_id, [])
 
-    def add_ww_edge(self, t_id: str) -> bool:
+    def add_ww_edge(self, t_id: str, candidate_ids: Set[str]):
         """
         Author(s):
             - Rishav Roy
@@ -399,10 +723,11 @@ class TransactionManager:
         # T --ww--> T' to the serialization graph if T commits before T'
         # begins, and they both write to x
 
-        t_map = self.transaction_map
         txn = self.transaction_map[t_id]
 
-        for other_txn in t_map.values():
+        # Only transactions that touched the same data items can conflict with T'
+        source_ids = []
+        for other_txn in self.get_candidate_transactions(candidate_ids):
             if other_txn.id == t_id:
                 continue
             if other_txn.status == TransactionStatus.COMMITTED and other_txn.commit_time < txn.start_time:
@@ -411,16 +736,12 @@ class TransactionManager:
                     if EdgeType.WW not in self.conflict_graph[other_txn.id]:
                         self.conflict_graph[other_txn.id][EdgeType.WW] = set()
                     self.conflict_graph[other_txn.id][EdgeType.WW].add(txn.id)
+                    source_ids.append(other_txn.id)
+                    if self.contention is not None:
+                        self.contention.record_edge(EdgeType.WW, other_txn.id, txn.id, common_writes)
+        self.log_graph_change("add", EdgeType.WW, txn.id, source_ids)
 
-                    # Check for RW cycle
-                    if self.has_rw_edge_cycle():
-                        self.remove_transaction_from_conflict_graph(t_id)
-                        self.abort_transaction(AbortType.CONSECUTIVE_RW_CYCLE, t_id)
-                        return False
-
-        return True
-
-    def add_wr_edge(self, t_id: str) -> bool:
+    def add_wr_edge(self, t_id: str, candidate_ids: Set[str]):
         """
         Author(s):
             - Rishav Roy
@@ -429,10 +750,11 @@ class TransactionManager:
         # T --wr--> T' to the serialization graph if T writes to x,
         # commits before T' begins, and T' reads from x
 
-        t_map = self.transaction_map
         txn = self.transaction_map[t_id]
 
-        for other_txn in t_map.values():
+        # Only transactions that touched the same data items can conflict with T'
+        source_ids = []
+        for other_txn in self.get_candidate_transactions(candidate_ids):
             if other_txn.id == t_id:
                 continue
             if other_txn.status == TransactionStatus.COMMITTED and other_txn.commit_time < txn.start_time:
@@ -441,16 +763,12 @@ class TransactionManager:
                     if EdgeType.WR not in self.conflict_graph[other_txn.id]:
                         self.conflict_graph[other_txn.id][EdgeType.WR] = set()
                     self.conflict_graph[other_txn.id][EdgeType.WR].add(txn.id)
+                    source_ids.append(other_txn.id)
+                    if self.contention is not None:
+                        self.contention.record_edge(EdgeType.WR, other_txn.id, txn.id, write_reads)
+        self.log_graph_change("add", EdgeType.WR, txn.id, source_ids)
 
-                    # Check for RW cycle
-                    if self.has_rw_edge_cycle():
-                        self.remove_transaction_from_conflict_graph(t_id)
-                        self.abort_transaction(AbortType.CONSECUTIVE_RW_CYCLE, t_id)
-                        return False
-
-        return True
-
-    def add_rw_edge(self, t_id: str, t_end_time: int) -> bool:
+    def add_rw_edge(self, t_id: str, t_end_time: int, candidate_ids: Set[str]):
         """
         Author(s):
             - Rishav Roy
@@ -459,10 +777,11 @@ class TransactionManager:
         # T --rw--> T' to the serialization graph if T reads from x, T' writes to
         # x, and T begins before end(T')
 
-        t_map = self.transaction_map
         txn = self.transaction_map[t_id]
 
-        for other_txn in t_map.values():
+        # Only transactions that touched the same data items can conflict with T'
+        source_ids = []
+        for other_txn in self.get_candidate_transactions(candidate_ids):
             if other_txn.id == t_id:
                 continue
             if other_txn.start_time < t_end_time:
@@ -471,78 +790,103 @@ class TransactionManager:
                     if EdgeType.RW not in self.conflict_graph[other_txn.id]:
                         self.conflict_graph[other_txn.id][EdgeType.RW] = set()
                     self.conflict_graph[other_txn.id][EdgeType.RW].add(txn.id)
+                    source_ids.append(other_txn.id)
+                    if self.contention is not None:
+                        self.contention.record_edge(EdgeType.RW, other_txn.id, txn.id, read_writes)
+        self.log_graph_change("add", EdgeType.RW, txn.id, source_ids)
 
-                    # Check for RW cycle
-                    if self.has_rw_edge_cycle():
-                        self.remove_transaction_from_conflict_graph(t_id)
-                        self.abort_transaction(AbortType.CONSECUTIVE_RW_CYCLE, t_id)
-                        return False
-
-        return True
-
-    def has_rw_edge_cycle(self) -> bool:
+    def has_rw_edge_cycle(self, t_id: str) -> bool:
         """
         Author(s):
             - Rishav Roy
         """
-        visited = set()
-        current_path = set()
-        edge_set = dict()
-
-        def dfs(node: str) -> bool:
-            visited.add(node)
-            current_path.add(node)
-
-            for edgeType in self.conflict_graph[node]:
-                for neighbor in self.conflict_graph[node][edgeType]:
-                    edge_set[node] = (edgeType, neighbor)
-
-                    if neighbor in current_path:
-                        return True
-
-                    has_cycle = dfs(neighbor)
-                    if has_cycle:
-                        return True
-            return False
-
-        def has_b2b_rw_edges(node: str, is_prev_rw: bool = False) -> bool:
-            edge_type, next_node = edge_set[node]
-            if edge_type == EdgeType.RW and is_prev_rw:
-                return True
-            if edge_type == EdgeType.RW:
-                check = has_b2b_rw_edges(next_node, True)
-                if check:
-                    return True
-
-            check = has_b2b_rw_edges(next_node, False)
-            if check:
-                return True
-
-        for t_id in self.transaction_map.keys():
-            if t_id not in visited:
-                current_path = set()
-                edge_set = dict()
-                contains_cycle = dfs(t_id)
-                if contains_cycle:
+        with self.profiler.phase("graph_dfs"):
+            return self._has_rw_edge_cycle(t_id)
+
+    def _has_rw_edge_cycle(self, t_id: str) -> bool:
+        """
+        Checks for two RW edges in a row, A --rw--> B --rw--> C, closed by a path C --> ... --> A,
+        i.e. A, B and C lie in one strongly connected component.
+        The path back from C may go through A or B again, so this finds a closed walk rather than
+        a simple cycle: every simple cycle with two RW edges in a row is caught, and so are a few
+        components where two such edges only close up through a repeated node.
+        Every commit leaves the graph without such a walk and t_id is the only node whose edges
+        changed since, so a new one has to go through t_id: only the strongly connected
+        component of t_id is searched, not the whole graph.
+        """
+        forward = self.reach(t_id)
+
+        # Nodes reachable from t_id that also reach back to it
+        predecessors: Dict[str, Set[str]] = dict()
+        for node in forward:
+            for neighbors in self.conflict_graph.get(node, {}).values():
+                for neighbor in neighbors:
+                    predecessors.setdefault(neighbor, set()).add(node)
+        component = {t_id}
+        stack = [t_id]
+        while stack:
+            node = stack.pop()
+            for predecessor in predecessors.get(node, ()):
+                if predecessor not in component:
+                    component.add(predecessor)
+                    stack.append(predecessor)
+
+        # Visited in begin order so that the cycle reported is the same from run to run
+        for first in sorted(component, key=self.begin_order.__getitem__):
+            middles = [node for node in self.conflict_graph[first].get(EdgeType.RW, ()) if node in component]
+            for middle in sorted(middles, key=self.begin_order.__getitem__):
+                lasts = [node for node in self.conflict_graph[middle].get(EdgeType.RW, ()) if node in component]
+                if lasts:
+                    last = min(lasts, key=self.begin_order.__getitem__)
                     if self.verbose:
                         print("Cycle detected in conflict graph")
-                        print(edge_set)
-                    if has_b2b_rw_edges(t_id, is_prev_rw=False):
-                        if self.verbose:
-                            print("Cycle has back to back RW edges")
-                        return True
+                        print(self.describe_cycle(first, middle, last, self.reach(last)))
+                        print("Cycle has back to back RW edges")
+                    return True
 
         return False
 
+    def reach(self, start: str) -> Dict[str, Tuple[Optional[str], Optional[EdgeType]]]:
+        # Nodes reachable from start -> (previous node, EdgeType) on the path found to them
+        parents = {start: (None, None)}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for edge_type, neighbors in self.conflict_graph.get(node, {}).items():
+                for neighbor in neighbors:
+                    if neighbor not in parents:
+                        parents[neighbor] = (node, edge_type)
+                        stack.append(neighbor)
+        return parents
+
+    def describe_cycle(self, first: str, middle: str, last: str, parents: dict) -> Dict[str, tuple]:
+        # Edges of the cycle first --rw--> middle --rw--> last --> ... --> first,
+        # listed from the transaction that began first
+        edges = {first: (EdgeType.RW, middle), middle: (EdgeType.RW, last)}
+        node = first
+        while node != last:
+            previous, edge_type = parents[node]
+            edges[previous] = (edge_type, node)
+            node = previous
+
+        start = min(edges, key=self.begin_order.__getitem__)
+        cycle = {}
+        node = start
+        while node not in cycle:
+            cycle[node] = edges[node]
+            node = edges[node][1]
+        return cycle
+
     def remove_transaction_from_conflict_graph(self, t_id: str):
         """
         Author(s):
             - Rishav Roy
         """
-        self.conflict_graph[t_id] = dict()
+        self.clear_conflict_graph_node(t_id)
 
         for transaction in self.transaction_map.values():
             for edgeType in self.conflict_graph[transaction.id]:
                 for neighbor_id in self.conflict_graph[transaction.id][edgeType].copy():
                     if neighbor_id == t_id:
                         self.conflict_graph[transaction.id][edgeType].remove(neighbor_id)
+                        self.log_graph_change("remove", edgeType, t_id, [transaction.id])
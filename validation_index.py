@@ -0,0 +1,103 @@
+from typing import Dict, Iterable, Optional, Set
+
+
+class ReaderWriterIndex:
+    """
+    Per data item index over the commit validation state:
+    who read and wrote every item, and when it was last committed.
+
+    Commit validation only needs the transactions that touched the same data items,
+    so instead of scanning every transaction ever seen (and every committed version at
+    every replica for the first committer rule), end() looks up the committing
+    transaction's items here.
+    """
+
+    def __init__(self):
+        # transactions that read a data item -> Dict[str, Set[str]]
+        # Format: data_id -> set of t_ids
+        self.readers: Dict[str, Set[str]] = {}
+
+        # transactions that wrote a data item -> Dict[str, Set[str]]
+        # Format: data_id -> set of t_ids
+        self.writers: Dict[str, Set[str]] = {}
+
+        # latest commit time of a data item -> Dict[str, int]
+        self.last_commit_time: Dict[str, int] = {}
+
+        # readers and writers added since the last checkpoint -> Dict[str, Set[str]]
+        # Only recorded while checkpointing (see track_changes): the sets only ever grow
+        self.new_readers: Optional[Dict[str, Set[str]]] = None
+        self.new_writers: Optional[Dict[str, Set[str]]] = None
+
+        # data items committed since the last checkpoint
+        self.dirty_data_ids: Set[str] = set()
+
+    def record_read(self, data_id: str, t_id: str):
+        self.readers.setdefault(data_id, set()).add(t_id)
+        if self.new_readers is not None:
+            self.new_readers.setdefault(data_id, set()).add(t_id)
+
+    def record_write(self, data_id: str, t_id: str):
+        self.writers.setdefault(data_id, set()).add(t_id)
+        if self.new_writers is not None:
+            self.new_writers.setdefault(data_id, set()).add(t_id)
+
+    def lookup(self, reads: Iterable[str], writes: Iterable[str], start_time: int) -> dict:
+        # Transactions that touched the committing transaction's data items, and the items committed since it began
+        found = {
+            "writers_of_writes": set(),
+            "writers_of_reads": set(),
+            "readers_of_writes": set(),
+            "committed_since_start": set()
+        }
+        for data_id in writes:
+            found["writers_of_writes"].update(self.writers.get(data_id, ()))
+            found["readers_of_writes"].update(self.readers.get(data_id, ()))
+            if self.last_commit_time.get(data_id, -1) > start_time:
+                found["committed_since_start"].add(data_id)
+        for data_id in reads:
+            found["writers_of_reads"].update(self.writers.get(data_id, ()))
+        return found
+
+    def record_commit(self, writes: Iterable[str], timestamp: int):
+        for data_id in writes:
+            self.last_commit_time[data_id] = timestamp
+            self.dirty_data_ids.add(data_id)
+
+    def export_entries(self, data_ids: Iterable[str]) -> Dict[str, tuple]:
+        # (readers, writers, last commit time) of every given data item, for checkpoints
+        return {
+            data_id: (self.readers.get(data_id), self.writers.get(data_id), self.last_commit_time.get(data_id))
+            for data_id in data_ids
+        }
+
+    def track_changes(self):
+        # Starts recording the changes a checkpoint delta is built from, dropping those recorded so far
+        self.new_readers = {}
+        self.new_writers = {}
+        self.dirty_data_ids.clear()
+
+    def export_changes(self) -> Dict[str, tuple]:
+        # (readers added, writers added, last commit time) of every data item changed since the last checkpoint
+        data_ids = set(self.new_readers) | set(self.new_writers) | self.dirty_data_ids
+        return {
+            data_id: (self.new_readers.get(data_id), self.new_writers.get(data_id), self.last_commit_time.get(data_id))
+            for data_id in data_ids
+        }
+
+    def import_changes(self, changes: Dict[str, tuple]):
+        for data_id, (new_readers, new_writers, last_commit_time) in changes.items():
+            if new_readers:
+                self.readers.setdefault(data_id, set()).update(new_readers)
+            if new_writers:
+                self.writers.setdefault(data_id, set()).update(new_writers)
+            if last_commit_time is not None:
+                self.last_commit_time[data_id] = last_commit_time
+
+    def import_entries(self, entries: Dict[str, tuple]):
+        for data_id, (readers, writers, last_commit_time) in entries.items():
+            for state, value in ((self.readers, readers), (self.writers, writers), (self.last_commit_time, last_commit_time)):
+                if value is None:
+                    state.pop(data_id, None)
+                else:
+                    state[data_id] = value